@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the per-instantiation cost of walking the form fields:
+re-walking `iter_valid_fields` (what `MongoForm.__init__` and `save` used
+to do on every call) against iterating the precomputed `_field_plan`.
+
+Run from the repository root, no database is needed:
+
+    python benchmarks/field_plan.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from django.conf import settings
+settings.configure()
+
+from mongoengine import (Document, EmbeddedDocument, StringField, IntField,
+                         ListField, EmbeddedDocumentField)
+
+from mongoforms import MongoForm
+from mongoforms.utils import iter_valid_fields
+
+NUMBER = 10000
+
+
+class Item(EmbeddedDocument):
+    name = StringField(max_length=50)
+    quantity = IntField()
+
+
+WideDocument = type('WideDocument', (Document,), dict(
+    [('field_%02d' % i, StringField(max_length=50)) for i in range(40)] +
+    [('item', EmbeddedDocumentField(Item)),
+     ('items', ListField(EmbeddedDocumentField(Item)))]))
+
+
+class WideForm(MongoForm):
+    class Meta:
+        document = WideDocument
+        fields = tuple(['field_%02d' % i for i in range(40)] +
+                       ['item__name', 'items__name', 'items__quantity'])
+
+
+def walk_fields():
+    for field_name, field in iter_valid_fields(WideForm._meta):
+        pass
+
+
+def walk_plan():
+    for entry in WideForm._field_plan:
+        pass
+
+
+def instantiate():
+    WideForm(instance=instance)
+
+
+if __name__ == '__main__':
+    instance = WideDocument(**dict(('field_%02d' % i, u'value')
+                                   for i in range(40)))
+    for label, func in (('iter_valid_fields walk', walk_fields),
+                        ('field plan walk', walk_plan),
+                        ('MongoForm(instance=...)', instantiate)):
+        elapsed = timeit.timeit(func, number=NUMBER)
+        print '%-25s %8.2f us/call' % (label, elapsed / NUMBER * 1e6)
@@ -0,0 +1,306 @@
+"""
+Benchmarks of the mongoforms hot paths.
+
+Run from the repository root against mongomock (the default) or a local
+mongod, results are written as JSON so that releases can be compared:
+
+    python benchmarks/run.py --output before.json
+    python benchmarks/run.py --host mongodb://localhost/mongoforms_bench \\
+        --compare before.json --tolerance 0.2
+
+With --compare the exit status is 1 when a benchmark got slower than the
+baseline by more than the tolerance. Benchmarks can be selected by giving
+name prefixes as positional arguments. render_bootstrap3 is skipped when
+django-bootstrap3 isn't installed.
+"""
+import copy
+import json
+import optparse
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import bootstrap3
+except ImportError:
+    bootstrap3 = None
+
+from django.conf import settings
+settings.configure(
+    INSTALLED_APPS=['bootstrap3'] if bootstrap3 else [],
+    TEMPLATES=[{'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'APP_DIRS': True}],
+)
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+import mongoengine
+from mongoengine import (Document, EmbeddedDocument, StringField, IntField,
+                         FloatField, BooleanField, ListField, EmbeddedDocumentField)
+
+from mongoforms import MongoForm
+from mongoforms.fields import ReferenceField as ReferenceFormField
+from mongoforms.forms import (MongoFormMetaClass, clear_mongoform_factory_cache, warm_up,
+                              _mongoform_factory_cache)
+
+# the benchmarks, in registration order
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return register
+
+
+class Item(EmbeddedDocument):
+    name = StringField(max_length=50)
+    quantity = IntField()
+
+
+class Leaf(EmbeddedDocument):
+    label = StringField(max_length=50)
+    value = FloatField()
+
+
+class Branch(EmbeddedDocument):
+    name = StringField(max_length=50)
+    leaves = ListField(EmbeddedDocumentField(Leaf))
+    leaf = EmbeddedDocumentField(Leaf)
+
+
+class Trunk(EmbeddedDocument):
+    name = StringField(max_length=50)
+    branches = ListField(EmbeddedDocumentField(Branch))
+
+
+class BenchParent(Document):
+    name = StringField(max_length=50)
+
+    def __unicode__(self):
+        return self.name
+
+
+WideDocument = type('WideDocument', (Document,), dict(
+    [('string_%02d' % i, StringField(max_length=50)) for i in range(30)] +
+    [('int_%02d' % i, IntField()) for i in range(15)] +
+    [('bool_%02d' % i, BooleanField()) for i in range(5)]))
+
+
+class NestedDocument(Document):
+    title = StringField(max_length=50)
+    trunk = EmbeddedDocumentField(Trunk)
+    trunks = ListField(EmbeddedDocumentField(Trunk))
+
+
+class ItemsDocument(Document):
+    title = StringField(max_length=50)
+    items = ListField(EmbeddedDocumentField(Item))
+
+
+def form_class(document):
+    return MongoFormMetaClass('%sForm' % document.__name__, (MongoForm,),
+                              {'Meta': type('Meta', (object,), {'document': document})})
+
+
+WideForm = form_class(WideDocument)
+ItemsForm = form_class(ItemsDocument)
+
+wide_instance = WideDocument(**dict(
+    [('string_%02d' % i, u'value %d' % i) for i in range(30)] +
+    [('int_%02d' % i, i) for i in range(15)]))
+wide_data = dict(
+    [('string_%02d' % i, u'value %d' % i) for i in range(30)] +
+    [('int_%02d' % i, str(i)) for i in range(15)] +
+    [('bool_%02d' % i, 'on') for i in range(5)])
+
+
+def items_json(rows):
+    return {'title': u'items', 'items': [
+        {'name': u'item %d' % i, 'quantity': i, 'ORDER': rows - i} for i in range(rows)]}
+
+
+def items_data(rows):
+    data = {'title': u'items',
+            'items-TOTAL_FORMS': str(rows), 'items-INITIAL_FORMS': str(rows)}
+    for i in range(rows):
+        data['items-%d-name' % i] = u'item %d' % i
+        data['items-%d-quantity' % i] = str(i)
+        data['items-%d-ORDER' % i] = str(rows - i)
+    return data
+
+
+@benchmark('class_creation_wide')
+def bench_class_creation_wide():
+    form_class(WideDocument).build_fields()
+
+
+@benchmark('class_creation_lazy')
+def bench_class_creation_lazy():
+    form_class(WideDocument)
+
+
+@benchmark('class_creation_nested')
+def bench_class_creation_nested():
+    clear_mongoform_factory_cache()
+    form_class(NestedDocument).build_fields()
+    # and the embedded forms generated meanwhile, level by level
+    while warm_up(list(_mongoform_factory_cache.values())):
+        pass
+
+
+@benchmark('init_unbound')
+def bench_init_unbound():
+    WideForm()
+
+
+@benchmark('init_instance')
+def bench_init_instance():
+    WideForm(instance=wide_instance)
+
+
+@benchmark('is_valid_scalar')
+def bench_is_valid_scalar():
+    WideForm(wide_data).is_valid()
+
+
+@benchmark('validator_scalar')
+def bench_validator_scalar():
+    WideForm.get_validator().validate(wide_data)
+
+
+def bench_value_from_datadict(rows):
+    data = items_data(rows)
+    # a copy, as the widget of the base field is shared by the form instances
+    widget = copy.deepcopy(ItemsForm.base_fields['items']).widget
+
+    def bench():
+        widget.value_from_datadict(data, None, 'items')
+    return bench
+
+for rows in (10, 100, 1000):
+    benchmark('formset_value_from_datadict_%d' % rows)(bench_value_from_datadict(rows))
+
+
+def bench_formset_is_valid(rows):
+    data = items_data(rows)
+
+    def bench():
+        ItemsForm(data).is_valid()
+    return bench
+
+for rows in (10, 100):
+    benchmark('formset_is_valid_%d' % rows)(bench_formset_is_valid(rows))
+
+
+def bench_formset_validator(rows):
+    data = items_json(rows)
+    validator = ItemsForm.get_validator()
+
+    def bench():
+        validator.validate(data)
+    return bench
+
+for rows in (10, 100):
+    benchmark('validator_formset_%d' % rows)(bench_formset_validator(rows))
+
+
+def bench_render(method, rows):
+    instance = ItemsDocument(title=u'items', items=[
+        Item(name=u'item %d' % i, quantity=i) for i in range(rows)])
+
+    def bench():
+        form = ItemsForm(instance=instance)
+        getattr(form.fields['items'].widget, method)(
+            'items', form.initial['items'], attrs={'id': 'id_items'})
+    return bench
+
+benchmark('render_vanilla_10')(bench_render('render_vanilla', 10))
+if bootstrap3:
+    benchmark('render_bootstrap3_10')(bench_render('render_bootstrap3', 10))
+
+
+@benchmark('reference_choices_1000')
+def bench_reference_choices():
+    list(ReferenceFormField(BenchParent.objects).choices)
+
+
+def setup_database():
+    BenchParent.drop_collection()
+    BenchParent.objects.insert([BenchParent(name=u'parent %d' % i)
+                                for i in range(1000)])
+
+
+def measure(func, repeat, min_time=0.2):
+    """best time per call in seconds, calibrated to run at least min_time.."""
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time and number < 100000:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number, number
+
+
+def compare(results, baseline, tolerance):
+    """print a comparison table and return the names of the regressions.."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['best'] / baseline[name]['best']
+        print '%-36s %10.1f us -> %10.1f us  x%.2f' % (name,
+            baseline[name]['best'] * 1e6, result['best'] * 1e6, ratio)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark prefix ...]')
+    parser.add_option('--host', default='mongomock://localhost',
+                      help='mongodb uri, mongomock://localhost by default')
+    parser.add_option('--output', help='write the results to this JSON file')
+    parser.add_option('--compare', help='baseline JSON file to compare with')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='allowed slowdown ratio against the baseline')
+    parser.add_option('--repeat', type='int', default=5)
+    options, prefixes = parser.parse_args()
+
+    mongoengine.connect('mongoforms_bench', host=options.host)
+    setup_database()
+
+    results = {}
+    for name, func in BENCHMARKS:
+        if prefixes and not [p for p in prefixes if name.startswith(p)]:
+            continue
+        best, number = measure(func, options.repeat)
+        results[name] = {'best': best, 'number': number}
+        print '%-36s %10.1f us' % (name, best * 1e6)
+
+    report = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'mongoengine': mongoengine.get_version(),
+        'host': options.host,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(results, json.load(baseline)['results'],
+                                  options.tolerance)
+        if regressions:
+            print 'regressions: %s' % ', '.join(regressions)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.encoding import smart_unicode
+from bson import json_util
+from mongoengine import signals
+
+
+class ChoiceCache(object):
+    """
+    Process-wide cache of `ReferenceField` choices, shared by all the form
+    instances. Entries expire after `ttl` seconds and the least recently used
+    ones are evicted past `max_entries`. Saving or deleting a document of a
+    cached class drops its entries, bulk `QuerySet.update()` and `delete()`
+    send no signal and are only caught up by the ttl.
+    """
+
+    def __init__(self, ttl, max_entries=100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._documents = set()
+
+    def get_key(self, queryset):
+        """the queryset's collection, query filter, ordering, limits and loaded fields.."""
+        return (queryset._document._get_collection_name(),
+                json_util.dumps(queryset._query, sort_keys=True),
+                json_util.dumps(getattr(queryset, '_ordering', None)),
+                queryset._limit, queryset._skip,
+                json_util.dumps(queryset._loaded_fields.as_dict(), sort_keys=True))
+
+    def get_choices(self, queryset):
+        """
+        Returns the cached `(pk, label)` choices of the queryset, fetching
+        them on a miss.
+        """
+        key = self.get_key(queryset)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # move the entry to the most recently used end
+                self._entries[key] = entry
+                return entry[1]
+
+        choices = [(obj.pk, smart_unicode(obj)) for obj in queryset.clone()]
+        self.connect(queryset._document)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, choices)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return choices
+
+    def connect(self, document):
+        """invalidate the entries of the document class when it changes.."""
+        if document in self._documents:
+            return
+        self._documents.add(document)
+        try:
+            signals.post_save.connect(self._changed, sender=document, weak=False)
+            signals.post_delete.connect(self._changed, sender=document, weak=False)
+        except RuntimeError:
+            # blinker isn't installed, rely on the ttl
+            pass
+
+    def invalidate(self, document=None):
+        """drop the entries of the document class, or all of them.."""
+        with self._lock:
+            if document is None:
+                self._entries.clear()
+                return
+            collection = document._get_collection_name()
+            for key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[key]
+
+    def _changed(self, sender, **kwargs):
+        self.invalidate(sender)
+
+
+_choice_cache = None
+
+
+def get_choice_cache():
+    """
+    Returns the shared choice cache, or None unless it is enabled with the
+    `MONGOFORMS_CHOICE_CACHE_TTL` setting (in seconds). The number of cached
+    querysets is bounded by `MONGOFORMS_CHOICE_CACHE_MAX_ENTRIES`.
+    """
+    global _choice_cache
+    ttl = getattr(settings, 'MONGOFORMS_CHOICE_CACHE_TTL', None)
+    if not ttl:
+        return None
+    if _choice_cache is None:
+        _choice_cache = ChoiceCache(ttl,
+            getattr(settings, 'MONGOFORMS_CHOICE_CACHE_MAX_ENTRIES', 100))
+    return _choice_cache
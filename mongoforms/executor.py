@@ -0,0 +1,36 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.utils import translation
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(name):
+    """
+    Returns a thread pool of the process, created on first use and sized by
+    the `MONGOFORMS_THREADS` setting (4 by default). Jobs of the 'forms' pool
+    wait on jobs of the 'lookups' pool, they never share one.
+    """
+    with _lock:
+        if name not in _pools:
+            _pools[name] = ThreadPool(getattr(settings, 'MONGOFORMS_THREADS', 4))
+        return _pools[name]
+
+
+def in_language(func):
+    """
+    Wraps func to run in the caller's active language, error messages are
+    translated by the thread building them.
+    """
+    language = translation.get_language()
+
+    def inner(*args, **kwargs):
+        translation.activate(language)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            translation.deactivate()
+    return inner
@@ -1,9 +1,11 @@
 # -*- coding:utf-8 -*-
+import copy
+from operator import itemgetter
 
 from django import forms, VERSION as django_version
 from django.conf import settings
-from django.forms.formsets import (formset_factory, BaseFormSet, TOTAL_FORM_COUNT, INITIAL_FORM_COUNT,
-                                MAX_NUM_FORM_COUNT, DEFAULT_MAX_NUM, DELETION_FIELD_NAME, ORDERING_FIELD_NAME)
+from django.forms.formsets import (formset_factory, BaseFormSet, DELETION_FIELD_NAME,
+                                ORDERING_FIELD_NAME)
 from django.forms.fields import IntegerField, BooleanField
 
 if django_version < (1, 9):
@@ -11,13 +13,66 @@ if django_version < (1, 9):
 else:
     from django.forms.utils import ErrorList
 
+if django_version < (1, 8):
+    from django.test.signals import setting_changed
+else:
+    from django.core.signals import setting_changed
+
 from django.template import Context, Template
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 from bson.errors import InvalidId
+from bson.dbref import DBRef
 from bson.objectid import ObjectId
 from mongoengine import StringField, EmbeddedDocumentField, ObjectIdField, IntField, ReferenceField as Mongoengine_ReferenceField
-from mongoforms.utils import mongo_to_dict
+from mongoengine.errors import ValidationError as Mongoengine_ValidationError
+from mongoforms.cache import get_choice_cache
+from mongoforms.instrumentation import timed
+from mongoforms.utils import mongo_to_dict, reference_pk
+
+
+# row controls handled by mongoforms/formset.js
+ROW_CONTROLS = '<a href="#" data-formset-move="up">Up</a> ' \
+               '<a href="#" data-formset-move="down">Down</a> ' \
+               '<a href="#" data-formset-remove>Remove</a>'
+ROW_CONTROLS_BOOTSTRAP3 = '<div class="btn-group btn-group-xs">' \
+    '<a class="btn btn-default" href="#" data-formset-move="up" title="Move up"><span class="glyphicon glyphicon-arrow-up"></span></a>' \
+    '<a class="btn btn-default" href="#" data-formset-move="down" title="Move down"><span class="glyphicon glyphicon-arrow-down"></span></a>' \
+    '<a class="btn btn-danger" href="#" data-formset-remove title="Remove"><span class="glyphicon glyphicon-trash"></span></a>' \
+    '</div>'
+
+FORMSET_ROW_BOOTSTRAP3_TEMPLATE = '{% load bootstrap3 %}<li id="anchor_{{ name }}-{{ index }}" class="list-group-item anchor">{% bootstrap_form form %}{% if controls %}' + ROW_CONTROLS_BOOTSTRAP3 + '{% endif %}</li>'
+EMPTY_FORM_BOOTSTRAP3_TEMPLATE = '{% load bootstrap3 %}<div id="empty_{{ name }}" style="display: none;">{% bootstrap_form form %}' + ROW_CONTROLS_BOOTSTRAP3 + '</div>'
+FORM_BOOTSTRAP3_TEMPLATE = '{% load bootstrap3 %}{% bootstrap_form form %}</li>'
+
+# templates compiled once per process, see `compiled_template`
+_compiled_templates = {}
+_use_bootstrap3 = None
+
+
+def compiled_template(source):
+    """Returns the template compiled from the source, compiling it only once."""
+    template = _compiled_templates.get(source)
+    if template is None:
+        template = _compiled_templates[source] = Template(source)
+    return template
+
+
+def use_bootstrap3():
+    """Whether widgets render with django-bootstrap3, resolved once."""
+    global _use_bootstrap3
+    if _use_bootstrap3 is None:
+        _use_bootstrap3 = 'bootstrap3' in settings.INSTALLED_APPS
+    return _use_bootstrap3
+
+
+def _reset_template_state(setting, **kwargs):
+    global _use_bootstrap3
+    if setting in ('INSTALLED_APPS', 'TEMPLATES'):
+        _use_bootstrap3 = None
+        _compiled_templates.clear()
+
+setting_changed.connect(_reset_template_state)
 
 
 class ReferenceWidget(forms.Select):
@@ -38,15 +93,87 @@ class ReferenceWidget(forms.Select):
             return self._render(self.template_name, context, renderer)
 
 
+class ReferenceSearchWidget(ReferenceWidget):
+    """
+    Reference widget rendering only the selected document as an option, so
+    huge collections are never enumerated. The other choices are meant to be
+    fetched by the client from `url`, see `mongoforms.views.ReferenceSearchView`.
+    """
+    def __init__(self, url='', attrs=None):
+        super(ReferenceSearchWidget, self).__init__(attrs=attrs)
+        self.url = url
+
+    def selected_choices(self, value):
+        choices = [('', '----')]
+        pk = reference_pk(value)
+        if pk and hasattr(self.choices, 'queryset'):
+            try:
+                pk = self.choices.field.to_pk(pk)
+                obj = self.choices.queryset.clone().filter(pk=pk).first()
+            except (TypeError, InvalidId, Mongoengine_ValidationError):
+                # a malformed id posted to an invalid form
+                obj = None
+            if obj is not None:
+                choices.append((obj.pk, smart_unicode(obj)))
+        return choices
+
+    def render(self, name, value, attrs=None, *aargs, **kwaargs):
+        attrs = dict(attrs or {}, **{'data-search-url': self.url})
+        # render a copy so that the shared widget keeps its lazy choices
+        widget = copy.copy(self)
+        widget.choices = self.selected_choices(value)
+        return super(ReferenceSearchWidget, widget).render(name, value, attrs, *aargs, **kwaargs)
+
+
+class ReferenceChoiceIterator(object):
+    """
+    Lazily yields the choices of a `ReferenceField`. The referenced collection
+    is only queried when the choices are actually iterated (i.e. on render).
+    Inspired by `django.forms.models.ModelChoiceIterator`.
+    """
+    def __init__(self, field):
+        self.field = field
+        self.queryset = field.queryset
+
+    def __iter__(self):
+        yield ('', '----')
+        choice_cache = get_choice_cache()
+        if choice_cache is not None:
+            for choice in choice_cache.get_choices(self.queryset):
+                yield choice
+        else:
+            for obj in self.queryset.clone():
+                yield (obj.pk, smart_unicode(obj))
+
+    def __len__(self):
+        choice_cache = get_choice_cache()
+        if choice_cache is not None:
+            return len(choice_cache.get_choices(self.queryset)) + 1
+        return self.queryset.count() + 1
+
+
 class ReferenceField(forms.ChoiceField):
     """
     Reference field for mongo forms. Inspired by `django.forms.models.ModelChoiceField`.
     """
     widget=ReferenceWidget
+    iterator = ReferenceChoiceIterator
+
     def __init__(self, queryset, *aargs, **kwaargs):
+        # with a search url only the selected document is rendered
+        search_url = kwaargs.pop('search_url', None)
+        if search_url is not None:
+            kwaargs['widget'] = ReferenceSearchWidget(url=search_url)
         forms.Field.__init__(self, *aargs, **kwaargs)
         self.queryset = queryset
 
+    def __deepcopy__(self, memo):
+        result = forms.Field.__deepcopy__(self, memo)
+        # force a new iterator bound to the copied field, nothing is evaluated
+        if not hasattr(self, '_choices'):
+            result.queryset = self.queryset
+        return result
+
     def _get_queryset(self):
         return self._queryset
 
@@ -57,31 +184,55 @@ class ReferenceField(forms.ChoiceField):
     queryset = property(_get_queryset, _set_queryset)
 
     def _get_choices(self):
+        # explicitly set choices take precedence over the queryset
         if hasattr(self, '_choices'):
             return self._choices
 
-        self._choices = [('', '----')] + [(obj.pk, smart_unicode(obj)) for obj in self.queryset]
-        return self._choices
+        return self.iterator(self)
 
     choices = property(_get_choices, forms.ChoiceField._set_choices)
 
+    def validate(self, value):
+        # the value is checked against the queryset in `clean`, don't
+        # enumerate the whole collection to look for it
+        forms.Field.validate(self, value)
+
+    def to_pk(self, value):
+        """
+        Converts a submitted value to the type of the referenced document's
+        primary key. Raises `TypeError` or `InvalidId` for malformed ids.
+        """
+        id_field = self.queryset._document._meta.get('id_field', 'id')
+        if isinstance(self.queryset._document._fields[id_field], ObjectIdField):
+            return ObjectId(value)
+        return value
+
     def clean(self, value):
         try:
-            id_field = self.queryset._document._meta.get('id_field', 'id')
-            if isinstance(self.queryset._document._fields[id_field], ObjectIdField):
-                pk_value = ObjectId(value)
-            else:
-                pk_value = value
-            oid = super(ReferenceField, self).clean(pk_value)
-            if 'id' in self.queryset._query_obj.query:
-                obj = self.queryset.get()
-            else:
-                obj = self.queryset.get(id=oid)
+            oid = super(ReferenceField, self).clean(self.to_pk(value))
+            with timed(None, 'lookup'):
+                if 'id' in self.queryset._query_obj.query:
+                    obj = self.queryset.get()
+                else:
+                    obj = self.queryset.get(id=oid)
         except (TypeError, InvalidId, self.queryset._document.DoesNotExist):
             raise forms.ValidationError(self.error_messages['invalid_choice'] % {'value':value})
         return obj
 
 
+class ReferenceIdField(ReferenceField):
+    """
+    Reference field which only checks the submitted id and returns it as a
+    primary key, without fetching the document. Used where the caller
+    resolves many references at once.
+    """
+    def clean(self, value):
+        try:
+            return self.to_pk(forms.Field.clean(self, value))
+        except (TypeError, InvalidId):
+            raise forms.ValidationError(self.error_messages['invalid_choice'] % {'value':value})
+
+
 class StringForm(forms.Form):
     da_string = forms.CharField(label=" ", required=True)
 
@@ -95,22 +246,69 @@ class StringForm(forms.Form):
         return cleaned_data.get('da_string')
 
     @classmethod
-    def format_values(cls, datas):
+    def format_values(cls, datas, rows=None):
         return datas
 
+    @classmethod
+    def clean_values(cls, values):
+        return values
+
+
+class UnknownReference(DBRef):
+    """a submitted id which matches no document, from the given formset row.."""
+    def __init__(self, collection, id, row):
+        super(UnknownReference, self).__init__(collection, id)
+        self.row = row
+
 
 class BaseReferenceForm(StringForm):
 
     @classmethod
     def format_initial(cls, initial):
         if initial:
-            return [{'da_string': i.id} for i in initial if i]
+            return [{'da_string': reference_pk(i)} for i in initial if i]
 
     @classmethod
     def to_python(cls, cleaned_data):
-        doc_id = cleaned_data.get('da_string')
-        if doc_id:
-            return cls.document.objects.get(id=doc_id)
+        return cleaned_data.get('da_string') or None
+
+    @classmethod
+    def format_values(cls, datas, rows=None):
+        """
+        Resolves all the submitted ids with a single query. Ids which do not
+        match any document are kept as `UnknownReference` with the number of
+        their row (`rows`, their position by default) and reported by
+        `clean_values`.
+        """
+        field = cls.base_fields['da_string']
+        pks = []
+        for doc_id in datas:
+            try:
+                pks.append(doc_id and field.to_pk(doc_id))
+            except (TypeError, InvalidId):
+                pks.append(doc_id)
+
+        with timed(None, 'lookup'):
+            docs = cls.document.objects.in_bulk([pk for pk in pks if pk])
+        collection = cls.document._get_collection_name()
+        values = []
+        for pk, row in zip(pks, rows or xrange(1, len(pks) + 1)):
+            if pk and pk not in docs:
+                values.append(UnknownReference(collection, pk, row))
+            else:
+                values.append(pk and docs[pk])
+        return values
+
+    @classmethod
+    def clean_values(cls, values):
+        message = cls.base_fields['da_string'].error_messages['invalid_choice']
+        unknown = sorted([value for value in values if isinstance(value, UnknownReference)],
+                         key=lambda value: value.row)
+        errors = ['da_string %s : %s' % (value.row, message % {'value': value.id})
+                  for value in unknown]
+        if errors:
+            raise forms.ValidationError(errors)
+        return values
 
 
 class DictForm(forms.Form):
@@ -130,12 +328,16 @@ class DictForm(forms.Form):
             return {}
 
     @classmethod
-    def format_values(cls, datas):
+    def format_values(cls, datas, rows=None):
         d = {}
         for dico in datas:
             d.update(dico)
         return d
 
+    @classmethod
+    def clean_values(cls, values):
+        return values
+
 
 class MixinEmbeddedForm(object):
     @classmethod
@@ -148,12 +350,18 @@ class MixinEmbeddedForm(object):
 
     @classmethod
     def to_python(cls, cleaned_data):
-        return cls.Meta.document(**cleaned_data)
+        # only pass the document fields, not the extra form fields
+        return cls.Meta.document(**dict([(entry.name, cleaned_data[entry.name])
+            for entry in cls._field_plan if entry.name in cleaned_data]))
 
     @classmethod
-    def format_values(cls, datas):
+    def format_values(cls, datas, rows=None):
         return datas
 
+    @classmethod
+    def clean_values(cls, values):
+        return values
+
 
 class MixinEmbeddedFormset(MixinEmbeddedForm):
 
@@ -165,10 +373,25 @@ class MixinEmbeddedFormset(MixinEmbeddedForm):
             except AttributeError:
                 return initial
 
+def set_readonly(form):
+    """mark the fields of a (sub)form readonly.."""
+    for field in form.fields.values():
+        field.widget.attrs['readonly'] = "readonly"
+        if field.widget.attrs.get('class'):
+            field.widget.attrs['class'] += " disabled"
+        else:
+            field.widget.attrs['class'] = "disabled"
+
+
 class MongoFormFormSet(BaseFormSet):
     def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
-                 initial=None, error_class=ErrorList, form_attrs=None):
+                 initial=None, error_class=ErrorList, form_attrs=None, can_delete=None,
+                 readonly=False):
         self.form_attrs = form_attrs or {}
+        self.readonly = readonly
+        if can_delete is not None:
+            # per instance, the class is shared by all the forms
+            self.can_delete = can_delete
         super(MongoFormFormSet, self).__init__(data=data, files=files,
             auto_id=auto_id, prefix=prefix, initial=initial, error_class=error_class)
 
@@ -178,6 +401,25 @@ class MongoFormFormSet(BaseFormSet):
         for i in xrange(min(self.total_form_count(), self.absolute_max)):
             self.forms.append(self._construct_form(i, **self.form_attrs))
 
+    def _construct_form(self, i, **kwargs):
+        form = super(MongoFormFormSet, self)._construct_form(i, **kwargs)
+        if self.readonly:
+            set_readonly(form)
+        return form
+
+    def iter_forms(self):
+        """
+        Yields the forms of the formset. Unless they were already built (e.g.
+        by validation) each form is built when it is reached and not kept, so
+        rendering a large unbound formset doesn't hold all of them.
+        """
+        if 'forms' in self.__dict__:
+            for form in self.forms:
+                yield form
+            return
+        for i in xrange(min(self.total_form_count(), self.absolute_max)):
+            yield self._construct_form(i, **self.form_attrs)
+
     def add_fields(self, form, index):
         """A hook for adding extra fields on to each form instance."""
         if self.can_order:
@@ -190,11 +432,66 @@ class MongoFormFormSet(BaseFormSet):
             form.fields[DELETION_FIELD_NAME] = BooleanField(label=_(u'Delete'), required=False)
 
 
+class FormsetValue(object):
+    """
+    Value returned by `FormsetInput.value_from_datadict`: the value built from
+    the valid rows and the `(row number, errors)` of the invalid ones, so that
+    `FormsetField.clean` reports them without validating the rows again. The
+    bound formset is kept for rendering, widgets hold no per request state.
+    """
+    def __init__(self, value, row_errors, formset=None, origins=None):
+        self.value = value
+        self.row_errors = row_errors
+        self.formset = formset
+        self.origins = origins
+
+
+class RowList(list):
+    """
+    The cleaned value of a list `FormsetField` bound to a formset, with the
+    `origins` of its items: the index of the stored item each row was
+    rendered from, None for the added rows. `MongoForm.save` writes the
+    changes of the list rather than the whole list.
+    """
+    def __init__(self, values, origins):
+        super(RowList, self).__init__(values)
+        self.origins = origins
+
+
+def plain_value(value):
+    """
+    The value read by a nested widget as its field's `to_python` expects it:
+    the value carried by a `FormsetValue` or a `FormValue`, a `RowList` as a
+    plain list.
+    """
+    if isinstance(value, (FormsetValue, FormValue)):
+        value = value.value
+    if isinstance(value, RowList):
+        value = list(value)
+    return value
+
+
+class FormValue(object):
+    """
+    Value returned by `FormInput.value_from_datadict`, the embedded document
+    and the bound subform it was built from.
+    """
+    def __init__(self, value, form=None):
+        self.value = value
+        self.form = form
+
+
 class FormsetInput(forms.Widget):
+    """
+    Renders a formset, rows are added, removed and reordered client side by
+    mongoforms/formset.js (jQuery) which is part of the widget's media.
+    """
+
+    class Media:
+        js = ('mongoforms/formset.js',)
 
     def __init__(self, form=None, form_attrs=None, name='', attrs=None):
         super(FormsetInput, self).__init__(attrs=attrs)
-        self.form = None
         self.form_cls = form
         self.form_attrs = form_attrs or {}
         self.name = name
@@ -202,145 +499,130 @@ class FormsetInput(forms.Widget):
 
     def _instanciate_formset(self, data=None, initial=None, readonly=False):
         initial = self.form_cls.format_initial(initial)
-        self.form = self.formset(data, initial=initial, prefix=self.name, form_attrs=self.form_attrs)
-        if readonly:
-            self.formset.can_delete = False
-            for form in self.form.forms:
-                for field_name in form.fields.keys():
-                    form.fields[field_name].widget.attrs['readonly'] = "readonly"
-                    if form.fields[field_name].widget.attrs.get('class'):
-                        form.fields[field_name].widget.attrs['class'] += " disabled"
-                    else:
-                        form.fields[field_name].widget.attrs['class'] = "disabled"
+        formset = self.formset(data, initial=initial, prefix=self.name, form_attrs=self.form_attrs,
+                               can_delete=False if readonly else None, readonly=readonly)
         if data:
-            self.form.is_valid()
+            formset.is_valid()
+        return formset
+
+    def get_formset(self, value, attrs=None):
+        """
+        Returns the formset to render: the bound one carried by the value, or
+        a new one built from the initial value.
+        """
+        if isinstance(value, FormsetValue):
+            return value.formset
+        return self._instanciate_formset(initial=value, readonly=(attrs or {}).get('readonly'))
 
     def render(self, name, value, attrs=None):
-        if 'bootstrap3' in settings.INSTALLED_APPS:
-            return self.render_bootstrap3(name, value, attrs=attrs)
+        with timed(None, 'render', name):
+            return u''.join(self.iter_render(name, value, attrs=attrs))
+
+    def iter_render(self, name, value, attrs=None):
+        """
+        Yields the HTML of the widget in chunks, one per row, e.g. to feed a
+        `StreamingHttpResponse` without holding the markup of every row.
+        """
+        if use_bootstrap3():
+            return self.iter_render_bootstrap3(name, value, attrs=attrs)
         else:
-            return self.render_vanilla(name, value, attrs=attrs)
+            return self.iter_render_vanilla(name, value, attrs=attrs)
 
     def render_vanilla(self, name, value, attrs=None):
-        if not self.form:
-            self._instanciate_formset(initial=value, readonly=attrs.get('readonly'))
+        return u''.join(self.iter_render_vanilla(name, value, attrs=attrs))
 
-        form_html = self.form.management_form.as_p()
-        form_html += '<ul class="formset %s">%s</ul>' % (self.name,
-         ''.join(['<li><ul>%s</ul></li>' % f.as_ul() for f in self.form.forms]))
+    def iter_render_vanilla(self, name, value, attrs=None):
+        formset = self.get_formset(value, attrs)
+
+        yield formset.management_form.as_p()
+        yield '<ul class="formset %s" data-formset="%s" data-formset-row-class="list-group-item">' % (
+            self.name, self.name)
+        controls = u'' if attrs.get('readonly') else ROW_CONTROLS
+        for form in formset.iter_forms():
+            yield '<li><ul>%s</ul>%s</li>' % (form.as_ul(), controls)
+        yield '</ul>'
 
         if attrs.get('readonly'):
-            return form_html
-        name_as_funcname = self.name.replace('-', '_')
-        management_javascript = """
-        <a href="#add_%s" id="add_%s">Add an entry</a>
-        <script type="text/javascript">
-          function add_form_%s(src_form, str_id, append_to) {
-            var num = parseInt($('#id_'+str_id+'-%s').val() || 0);
-            $('#id_'+str_id+'-%s').val(num+1);
-
-            var html = $(src_form).html().replace(/%s-__prefix__/g, '%s-'+num);
-            $('<li class="list-group-item">'+html+'</li>').appendTo($(append_to));
-            if($('input#id_%s-'+num+'-%s').length>0){
-              $('input#id_%s-'+num+'-%s').val(num+1);
-            }
-            return false;
-          }
-          $(document).ready(function(){
-            $('a#add_%s').click(function(event){
-              add_form_%s('#empty_%s', '%s', 'ul.%s');
-              return false;
-            });
-          });
-        </script>
-        """ % (self.name, self.name, name_as_funcname, TOTAL_FORM_COUNT, TOTAL_FORM_COUNT,
-               self.name, self.name,
-               self.name, ORDERING_FIELD_NAME, self.name, ORDERING_FIELD_NAME,
-               self.name, name_as_funcname, self.name, self.name, self.name)
-        empty_form = '<div id="empty_%s" style="display: none;">' \
-                     '<li><ul>%s</ul></li></div>' % \
-                      (self.name, self.form.empty_form.as_ul())
-
-        return form_html + empty_form + management_javascript
+            return
+        yield '<div id="empty_%s" style="display: none;">' \
+              '<li><ul>%s</ul>%s</li></div>' % \
+              (self.name, formset.empty_form.as_ul(), ROW_CONTROLS)
+        yield '<a href="#add_%s" id="add_%s" data-formset-add="%s">Add an entry</a>' % (
+            self.name, self.name, self.name)
 
     def render_bootstrap3(self, name, value, attrs=None):
-        if not self.form:
-            self._instanciate_formset(initial=value, readonly=attrs.get('readonly'))
+        return u''.join(self.iter_render_bootstrap3(name, value, attrs=attrs))
 
-        form_html = self.form.management_form.as_p()
-        form_html += '<ul class="list-group formset %s">%s</ul>' % (self.name,
-            Template('{% load bootstrap3 %}{% for f in form.forms %}<li id="anchor_{{ name }}-{{ forloop.counter0 }}" class="list-group-item anchor">{% bootstrap_form f %}</li>{% endfor %}').render(Context({'form': self.form, 'name': attrs['id']})))
-        if attrs.get('readonly'):
-            return form_html
-
-        name_as_funcname = self.name.replace('-', '_')
+    def iter_render_bootstrap3(self, name, value, attrs=None):
+        formset = self.get_formset(value, attrs)
         button_plus_one = """
-        <a class="btn btn-primary btn-xs" href="#add_%s" id="add_%s" title="Add an entry">
+        <a class="btn btn-primary btn-xs" href="#add_%s" id="add_%s" data-formset-add="%s" title="Add an entry">
             <span class="glyphicon glyphicon-plus"></span>
         </a>
-        """ % (self.name, self.name)
-        management_javascript = """
-        <script type="text/javascript">
-          function add_form_%s(src_form, str_id, append_to) {
-            var num = parseInt($('#id_'+str_id+'-%s').val());
-            $('#id_'+str_id+'-%s').val(num+1);
-
-            var html = $(src_form).html().replace(/%s-__prefix__/g, '%s-'+num);
-            $('<li class="list-group-item anchor">'+html+'</li>').appendTo($(append_to));
-            if($('input#id_%s-'+num+'-%s').length>0){
-              $('input#id_%s-'+num+'-%s').val(num+1);
-            }
-            return false;
-          }
-          $(document).ready(function(){
-            $('a#add_%s').click(function(event){
-              add_form_%s('#empty_%s', '%s', 'ul.%s');
-              return false;
-            });
-          });
-        </script>
-        """ % (name_as_funcname, TOTAL_FORM_COUNT, TOTAL_FORM_COUNT,
-               self.name, self.name,
-               self.name, ORDERING_FIELD_NAME, self.name, ORDERING_FIELD_NAME,
-               self.name, name_as_funcname, self.name, self.name, self.name)
-        t = Template('{% load bootstrap3 %}'+
-            '<div id="empty_%s" style="display: none;">'% self.name +
-            '{% bootstrap_form form %}</div>' )
-        c = Context({'form': self.form.empty_form})
-        empty_form = t.render(c)
-        return button_plus_one + management_javascript + form_html + empty_form + button_plus_one
+        """ % (self.name, self.name, self.name)
+
+        if not attrs.get('readonly'):
+            yield button_plus_one
+        yield formset.management_form.as_p()
+        yield '<ul class="list-group formset %s" data-formset="%s" data-formset-row-class="list-group-item anchor">' % (
+            self.name, self.name)
+        row_template = compiled_template(FORMSET_ROW_BOOTSTRAP3_TEMPLATE)
+        for index, form in enumerate(formset.iter_forms()):
+            yield row_template.render(Context({'form': form, 'name': attrs['id'], 'index': index,
+                                               'controls': not attrs.get('readonly')}))
+        yield '</ul>'
+        if attrs.get('readonly'):
+            return
+
+        c = Context({'form': formset.empty_form, 'name': self.name})
+        yield compiled_template(EMPTY_FORM_BOOTSTRAP3_TEMPLATE).render(c)
+        yield button_plus_one
 
     def value_from_datadict(self, data, files, name):
         """
         Given a dictionary of data and this widget's name, returns the value
         of this widget. Returns None if it's not provided.
         """
-        self._instanciate_formset(data=data)
+        with timed(None, 'formset', name):
+            return self._parse_rows(data)
+
+    def _parse_rows(self, data):
+        formset = self._instanciate_formset(data=data)
+        initial_count = formset.initial_form_count()
         values = []
         ordering = []
-
-        for index in range(0, self.form.total_form_count()):
-
-            subform_prefix = self.form.prefix + u'-' + unicode(index) + u'-'
-            cleaned_data = {}
-            for field_name, field in self.form.forms[index].fields.items():
-                value = field.widget.value_from_datadict(data, None, subform_prefix+field_name)
-                if value:
-                    cleaned_data[field_name] = field.to_python(value)
-
-            if not cleaned_data.get(DELETION_FIELD_NAME):
-                if self.formset.can_order:
-                    if ORDERING_FIELD_NAME in cleaned_data:
-                        ordering.append(int(cleaned_data.pop(ORDERING_FIELD_NAME)))
-                    else:
-                        ordering.append(999)
-
-                values.append(self.form_cls.to_python(cleaned_data))
-
-        if ordering and len(ordering) == len(values):
-            values = sorted(values, cmp=lambda v1, v2: ordering[values.index(v1)] - ordering[values.index(v2)])
-
-        return self.form_cls.format_values(values)
+        origins = []
+        numbers = []
+        row_errors = []
+
+        # each row is validated once by the formset, the values are built from
+        # the valid rows and the errors are reported by `FormsetField.clean`
+        for index, form in enumerate(formset.forms, 1):
+            if formset.can_delete and formset._should_delete_form(form):
+                continue
+            if not form.is_valid():
+                row_errors.append((index, form.errors))
+                continue
+
+            cleaned_data = dict(form.cleaned_data)
+            cleaned_data.pop(DELETION_FIELD_NAME, None)
+            order = cleaned_data.pop(ORDERING_FIELD_NAME, None)
+            ordering.append(999 if order is None else order)
+            # the initial rows were rendered from the stored items, in order
+            origins.append(index - 1 if index <= initial_count else None)
+            numbers.append(index)
+
+            values.append(self.form_cls.to_python(cleaned_data))
+
+        if formset.can_order:
+            # stable sort on the order keys, rows with equal values keep their own key
+            rows = sorted(zip(ordering, values, origins, numbers), key=itemgetter(0))
+            values = [value for _, value, _, _ in rows]
+            origins = [origin for _, _, origin, _ in rows]
+            numbers = [number for _, _, _, number in rows]
+
+        return FormsetValue(self.form_cls.format_values(values, numbers), row_errors, formset,
+                            origins)
 
 
 class FormsetField(forms.Field):
@@ -355,37 +637,31 @@ class FormsetField(forms.Field):
                                            initial=initial, help_text=help_text)
 
     def clean(self, value):
-        datas = self.form_cls.format_initial(value)
-        if datas:
-            index = 1
-            for data in datas:
-                for field_name, field in data.items():
-                    if isinstance(field, list):
-                        management_data = {
-                            field_name + '-' + TOTAL_FORM_COUNT: len(field),
-                            field_name + '-' + INITIAL_FORM_COUNT: 0,
-                            field_name + '-' + MAX_NUM_FORM_COUNT: DEFAULT_MAX_NUM
-                        }
-                        data.update(management_data)
-                        if self.form_cls.base_fields[field_name].form_cls is StringForm:
-                            for idx, obj in enumerate(field):
-                                data[field_name + '-' + str(idx) +'-da_string'] = obj
-                        else:
-                            for idx, obj in enumerate(field):
-                                for k, v in obj.items():
-                                    data[field_name + '-' + str(idx) +'-' + k] = v
-                    elif isinstance(field, dict):
-                        data.update({
-                            field_name + '-' + TOTAL_FORM_COUNT: len(field.keys()),
-                            field_name + '-' + INITIAL_FORM_COUNT: 0,
-                            field_name + '-' + MAX_NUM_FORM_COUNT: DEFAULT_MAX_NUM
-                        })
-                f = self.form_cls(data, **self.form_attrs)
-                if not f.is_valid():
-                    raise forms.ValidationError(['%s %s : %s' % (field_name, index, errors[0]) for field_name, errors in f.errors.items()])
-                index += 1
+        origins = None
+        if isinstance(value, FormsetValue):
+            # the rows were already validated by the widget's formset
+            errors = ['%s %s : %s' % (field_name, index, field_errors[0])
+                      for index, form_errors in value.row_errors
+                      for field_name, field_errors in form_errors.items()]
+            if errors:
+                raise forms.ValidationError(errors)
+            origins = value.origins
+            value = value.value
+        value = self.form_cls.clean_values(value)
+        if origins is not None and isinstance(value, list) and len(value) == len(origins):
+            value = RowList(value, origins)
         return value
 
+    def has_changed(self, initial, data):
+        # compare the rows' value, not the carrier of the bound formset
+        if isinstance(data, FormsetValue):
+            if data.row_errors:
+                return True
+            data = data.value
+        if not initial and not data:
+            return False
+        return super(FormsetField, self).has_changed(initial, data)
+
     def get_widget_extra_args(self):
         return {}
 
@@ -393,56 +669,65 @@ class FormsetField(forms.Field):
 class FormInput(forms.Widget):
     def __init__(self, form=None, name='', attrs=None):
         super(FormInput, self).__init__(attrs=attrs)
-        self.form = None
         self.form_cls = form
         self.name = name
 
+    @property
+    def media(self):
+        # the media of the subform's widgets, e.g. formset.js for its formsets
+        media = forms.Media()
+        for field in self.form_cls.base_fields.values():
+            media = media + field.widget.media
+        return media
+
     def _instanciate_form(self, data=None, initial=None, readonly=False):
         initial = self.form_cls.format_initial(initial)
-        self.form = self.form_cls(data, initial=initial, prefix=self.name)
+        form = self.form_cls(data, initial=initial, prefix=self.name)
         if readonly:
-            for field_name in self.form.fields.keys():
-                self.form.fields[field_name].widget.attrs['readonly'] = "readonly"
-                if self.form.fields[field_name].widget.attrs.get('class'):
-                    self.form.fields[field_name].widget.attrs['class'] += " disabled"
-                else:
-                    self.form.fields[field_name].widget.attrs['class'] = "disabled"
+            set_readonly(form)
         if data:
-            self.form.is_valid()
+            form.is_valid()
+        return form
+
+    def get_form(self, value, attrs=None):
+        """
+        Returns the subform to render: the bound one carried by the value, or
+        a new one built from the initial value.
+        """
+        if isinstance(value, FormValue):
+            return value.form
+        return self._instanciate_form(initial=value, readonly=(attrs or {}).get('readonly'))
 
     def render(self, name, value, attrs=None):
-        if 'bootstrap3' in settings.INSTALLED_APPS:
+        if use_bootstrap3():
             return self.render_bootstrap3(name, value, attrs=attrs)
         else:
             return self.render_vanilla(name, value, attrs=attrs)
 
     def render_vanilla(self, name, value, attrs=None):
-        if not self.form:
-            self._instanciate_form(initial=value, readonly=attrs.get('readonly'))
-        return self.form.as_ul()
+        return self.get_form(value, attrs).as_ul()
 
     def render_bootstrap3(self, name, value, attrs=None):
-        if not self.form:
-            self._instanciate_form(initial=value, readonly=attrs.get('readonly'))
-        return Template('{% load bootstrap3 %}{% bootstrap_form form %}</li>').render(Context({'form': self.form}))
+        return compiled_template(FORM_BOOTSTRAP3_TEMPLATE).render(Context({'form': self.get_form(value, attrs)}))
 
     def value_from_datadict(self, data, files, name):
         """
         Given a dictionary of data and this widget's name, returns the value
         of this widget. Returns None if it's not provided.
         """
-        self._instanciate_form(data=data)
+        form = self._instanciate_form(data=data)
 
-        subform_prefix = self.form.prefix + u'-'
+        subform_prefix = form.prefix + u'-'
         cleaned_data = {}
-        for field_name, field in self.form.fields.items():
+        for field_name, field in form.fields.items():
             value = field.widget.value_from_datadict(data, None, subform_prefix+field_name)
+            value = plain_value(value)
             if value:
                 cleaned_data[field_name] = field.to_python(value)
 
         values = self.form_cls.to_python(cleaned_data)
 
-        return self.form_cls.format_values(values)
+        return FormValue(self.form_cls.format_values(values), form)
 
 
 class FormField(forms.Field):
@@ -453,6 +738,24 @@ class FormField(forms.Field):
         super(FormField, self).__init__(required=required, label=label,
                                            initial=initial, help_text=help_text)
 
+    def clean(self, value):
+        if isinstance(value, FormValue):
+            value = value.value
+        return super(FormField, self).clean(value)
+
+    def has_changed(self, initial, data):
+        # compare the embedded document, not the carrier of the bound subform
+        if isinstance(data, FormValue):
+            data = data.value
+        return super(FormField, self).has_changed(initial, data)
+
+
+def queries_on_clean(field):
+    """whether reading and cleaning the field's data queries the database.."""
+    if isinstance(field, ReferenceField):
+        return not isinstance(field, ReferenceIdField)
+    return isinstance(field, FormsetField) and issubclass(field.form_cls, BaseReferenceForm)
+
 
 class MongoFormFieldGenerator(object):
     """This class generates Django form-fields for mongoengine-fields."""
@@ -596,7 +899,7 @@ class MongoFormFieldGenerator(object):
             )
         if isinstance(field.field, Mongoengine_ReferenceField):
             return FormsetField(
-                form=type(field.field.document_type.__name__+ 'ReferenceForm', (BaseReferenceForm,), {'da_string': ReferenceField(field.field.document_type.objects, label=" ", required=False), 'document': field.field.document_type})
+                form=type(field.field.document_type.__name__+ 'ReferenceForm', (BaseReferenceForm,), {'da_string': ReferenceIdField(field.field.document_type.objects, label=" ", required=False), 'document': field.field.document_type})
 ,
                 name=field_name,
                 **(self.get_base_attrs(field))
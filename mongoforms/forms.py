@@ -1,4 +1,7 @@
+import threading
+import time
 import types
+import weakref
 
 from django import forms, VERSION as django_version
 if django_version < (1, 9):
@@ -8,99 +11,221 @@ else:
     from collections import OrderedDict as SortedDict
     from django.forms.utils import ErrorList
 
+from mongoengine import signals
 from mongoengine.base import BaseDocument
-from fields import MongoFormFieldGenerator, FormsetField
-from utils import mongoengine_validate_wrapper, iter_valid_fields
-from mongoengine.fields import ReferenceField
+from pymongo import UpdateOne
+from executor import get_pool, in_language
+from instrumentation import instrumented, timed
+from fields import MongoFormFieldGenerator, FormsetField, RowList, queries_on_clean
+from validator import get_validator
+from utils import (mongoengine_validate_wrapper, build_field_plan, iter_plan_paths,
+                   iter_plan_updates, reference_pk, mongo_value, raw_to_dict,
+                   raw_to_python, array_updates)
 
 __all__ = ('MongoForm',)
 
+# every MongoForm class, see `warm_up`
+_form_classes = weakref.WeakSet()
+# held while generating fields, building a class builds its bases too
+_build_lock = threading.RLock()
+
+
+class LazyFormAttribute(object):
+    """
+    Stands for the generated `base_fields` and `_field_plan` of a MongoForm
+    class, which are built on first access.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        owner.build_fields()
+        return owner.__dict__[self.name]
+
+
 class MongoFormMetaClass(type):
-    """Metaclass to create a new MongoForm."""
+    """
+    Metaclass to create a new MongoForm. The form fields are generated from
+    the document when the class is first used, see `build_fields`.
+    """
 
     def __new__(cls, name, bases, attrs):
         # get all valid existing Fields and sort them
         fields = [(field_name, attrs.pop(field_name)) for field_name, obj in \
             attrs.items() if isinstance(obj, forms.Field)]
         fields.sort(lambda x, y: cmp(x[1].creation_counter, y[1].creation_counter))
+        attrs['_declared_fields'] = fields
+
+        attrs['base_fields'] = LazyFormAttribute('base_fields')
+        attrs['_field_plan'] = LazyFormAttribute('_field_plan')
+
+        # maybe we need the Meta class later
+        attrs['_meta'] = attrs.get('Meta', object())
+
+        new_class = super(MongoFormMetaClass, cls).__new__(cls, name, bases, attrs)
+        _form_classes.add(new_class)
+        return new_class
+
+    def is_built(cls):
+        return not isinstance(cls.__dict__['base_fields'], LazyFormAttribute)
+
+    def build_fields(cls):
+        """
+        Generates the form fields of the class, once. Called on the first
+        access of `base_fields` (e.g. instantiating the form) or by `warm_up`.
+        """
+        with _build_lock:
+            if cls.is_built():
+                return
+            with timed(cls.__name__, 'class'):
+                cls._build_fields()
+
+    def _build_fields(cls):
+        fields = list(cls._declared_fields)
+        meta = cls.__dict__.get('Meta')
 
         # get all Fields from base classes
-        for base in bases[::-1]:
+        for base in cls.__bases__[::-1]:
             if hasattr(base, 'base_fields'):
                 fields = base.base_fields.items() + fields
 
         # add the fields as "our" base fields
         # discards fields specified for embeddeddocuments
-        attrs['base_fields'] = SortedDict([f for f in fields if '__' not in f[0]])
+        base_fields = SortedDict([f for f in fields if '__' not in f[0]])
+
+        # the document fields handled by the form, computed once per class
+        field_plan = ()
 
         # Meta class available?
-        if 'Meta' in attrs and hasattr(attrs['Meta'], 'document') and \
-           issubclass(attrs['Meta'].document, BaseDocument):
-            labels = getattr(attrs['Meta'], 'labels', {})
+        if meta is not None and hasattr(meta, 'document') and \
+           issubclass(meta.document, BaseDocument):
+            field_plan = build_field_plan(meta)
+            labels = getattr(meta, 'labels', {})
             doc_fields = SortedDict()
 
-            meta_fields = list(getattr(attrs['Meta'], 'fields', []))
-            formfield_generator = getattr(attrs['Meta'], 'formfield_generator', \
-                MongoFormFieldGenerator)(meta_fields, overriden_fields=fields, exclude=getattr(attrs['Meta'], 'exclude', ()))
+            meta_fields = list(getattr(meta, 'fields', []))
+            formfield_generator = getattr(meta, 'formfield_generator', \
+                MongoFormFieldGenerator)(meta_fields, overriden_fields=fields, exclude=getattr(meta, 'exclude', ()))
 
             overriden_fields = dict(fields)
 
             # walk through the document fields
-            for field_name, field in iter_valid_fields(attrs['Meta']):
-                if field_name == '_cls':
-                    continue
+            for field_name, field, _, _, _ in field_plan:
                 # add field and override clean method to respect mongoengine-validator
                 if field_name in overriden_fields:
                     doc_fields[field_name] = overriden_fields[field_name]
                 else:
                     doc_fields[field_name] = formfield_generator.generate(field_name, field)
                 doc_fields[field_name].clean = mongoengine_validate_wrapper(
-                    doc_fields[field_name].clean, field._validate, field.required)
+                    doc_fields[field_name].clean, field._validate, field.required, field_name)
                 if labels.get(field_name):
                     doc_fields[field_name].label = labels[field_name]
 
             # write the new document fields to base_fields
-            doc_fields.update(attrs['base_fields'])
-            attrs['base_fields'] = doc_fields
+            doc_fields.update(base_fields)
+            base_fields = doc_fields
+
+        # the plan first, a built class is one with its base_fields
+        cls._field_plan = field_plan
+        cls.base_fields = base_fields
+
+
+def warm_up(classes=None):
+    """
+    Generates the fields of the given MongoForm classes, of all the classes
+    defined so far by default, and returns the `(class, seconds)` of each
+    class built. The time of a class includes the embedded forms it builds.
+    """
+    timings = []
+    pending = list(classes if classes is not None else _form_classes)
+    while pending:
+        for form_class in pending:
+            if not form_class.is_built():
+                start = time.time()
+                form_class.build_fields()
+                timings.append((form_class, time.time() - start))
+        # classes defined meanwhile, e.g. by mongoform_factory
+        pending = [] if classes is not None else \
+            [c for c in list(_form_classes) if not c.is_built()]
+    return timings
 
-        # maybe we need the Meta class later
-        attrs['_meta'] = attrs.get('Meta', object())
-
-        return super(MongoFormMetaClass, cls).__new__(cls, name, bases, attrs)
 
 class MongoForm(forms.BaseForm):
     """Base MongoForm class. Used to create new MongoForms"""
     __metaclass__ = MongoFormMetaClass
 
+    @instrumented('init')
     def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
         initial=None, error_class=ErrorList, label_suffix=':',
-        empty_permitted=False, instance=None, **kwargs):
-        """ initialize the form"""
+        empty_permitted=False, instance=None, raw=None, **kwargs):
+        """
+        initialize the form.. `raw` binds an existing document from its raw
+        dict (see `load_raw`) or `RawBSONDocument` rather than from an
+        instance.
+        """
 
         assert isinstance(instance, (types.NoneType, BaseDocument)), \
             'instance must be a mongoengine document, not %s' % \
                 type(instance).__name__
 
+        assert instance is None or raw is None, 'pass either an instance or a raw document'
+
         assert hasattr(self, 'Meta'), 'Meta class is needed to use MongoForm'
         # new instance or updating an existing one?
-        if instance is None:
+        if raw is not None:
+            self.instance = self._raw_instance(raw)
+            object_data = {}
+            self._stored_values = {}
+            # e.g. a RawBSONDocument, whose embedded documents are decoded too
+            decode = not isinstance(raw, dict)
+
+            # only the form's fields are read, embedded documents stay dicts
+            for field_name, field, is_reference, is_reference_list, _ in self._field_plan:
+                value = raw.get(field.db_field)
+                if decode:
+                    value = raw_to_dict(value)
+                if is_reference:
+                    field_data = reference_pk(value)
+                    self._stored_values[field_name] = field_data
+                    field_data = field_data and str(field_data)
+                elif is_reference_list:
+                    field_data = [reference_pk(ref) for ref in value or []]
+                    self._stored_values[field_name] = field_data
+                else:
+                    field_data = raw_to_python(field, value)
+                    self._stored_values[field_name] = value
+                object_data[field_name] = field_data
+        elif instance is None:
             if self._meta.document is None:
                 raise ValueError('MongoForm has no document class specified.')
             self.instance = self._meta.document()
             object_data = {}
             self.instance._adding = True
+            self._stored_values = {}
         else:
             self.instance = instance
             self.instance._adding = False
             object_data = {}
+            # stored values of the instance, used to only save changed fields
+            self._stored_values = {}
 
             # walk through the document fields
-            for field_name, field in iter_valid_fields(self._meta):
+            for field_name, field, is_reference, is_reference_list, _ in self._field_plan:
                 # add field data if needed
-                field_data = getattr(instance, field_name)
-                if isinstance(self._meta.document._fields[field_name], ReferenceField):
+                if is_reference:
+                    # read the stored reference to avoid dereferencing it,
                     # field data could be None for not populated refs
-                    field_data = field_data and str(field_data.id)
+                    field_data = reference_pk(instance._data.get(field_name))
+                    self._stored_values[field_name] = field_data
+                    field_data = field_data and str(field_data)
+                elif is_reference_list:
+                    field_data = [reference_pk(ref) for ref in
+                                  instance._data.get(field_name) or []]
+                    self._stored_values[field_name] = field_data
+                else:
+                    field_data = getattr(instance, field_name)
+                    self._stored_values[field_name] = mongo_value(field, field_data)
                 object_data[field_name] = field_data
 
         # additional initial data available?
@@ -116,20 +241,310 @@ class MongoForm(forms.BaseForm):
                 if isinstance(v, FormsetField):
                     v.widget.name = "%s-%s" % (prefix, v.widget.name)
 
+    def ais_valid(self, callback=None):
+        """
+        Validates the form in a thread pool and returns an `AsyncResult`
+        whose `get()` is `is_valid()`, so the caller's thread doesn't block
+        on the database. The fields querying it (references) are cleaned in
+        parallel. `callback` is called with the result from a pool thread.
+        """
+        return get_pool('forms').apply_async(in_language(self._validate_concurrently),
+                                             callback=callback)
+
+    def asave(self, commit=True, callback=None):
+        """`save()` in a thread pool, returns an `AsyncResult` of the instance.."""
+        return get_pool('forms').apply_async(in_language(self.save), (commit,),
+                                             callback=callback)
+
+    def _validate_concurrently(self):
+        if self._errors is None:
+            self._clean_concurrently()
+        return self.is_valid()
+
+    def _clean_concurrently(self):
+        """
+        Cleans the fields querying the database in parallel, then runs the
+        usual full_clean with their results.
+        """
+        names = [name for name, field in self.fields.items()
+                 if queries_on_clean(field) and not getattr(field, 'disabled', False)]
+        if not self.is_bound or len(names) < 2:
+            return self.full_clean()
+
+        def clean_field(name):
+            field = self.fields[name]
+            value = field.widget.value_from_datadict(self.data, self.files, self.add_prefix(name))
+            try:
+                return value, field.clean(value), None
+            except forms.ValidationError, e:
+                return value, None, e
+        results = get_pool('lookups').map(in_language(clean_field), names)
+
+        def reuse(field, (value, cleaned, error)):
+            # on the form's own copy of the field, shared by no other form
+            field.widget.value_from_datadict = lambda data, files, name: value
+
+            def clean(value):
+                if error is not None:
+                    raise error
+                return cleaned
+            field.clean = clean
+
+        originals = [(self.fields[name], self.fields[name].__dict__.get('clean'))
+                     for name in names]
+        for name, result in zip(names, results):
+            reuse(self.fields[name], result)
+        try:
+            self.full_clean()
+        finally:
+            for field, clean in originals:
+                del field.widget.value_from_datadict
+                if clean is None:
+                    del field.clean
+                else:
+                    field.clean = clean
+
+    def iter_render_field(self, field_name, attrs=None):
+        """
+        Yields the HTML of a field's widget in chunks, row by row for the
+        formsets, to render large embedded lists with a streaming response::
+
+            StreamingHttpResponse(form.iter_render_field('items'))
+        """
+        bound_field = self[field_name]
+        widget = bound_field.field.widget
+        if not hasattr(widget, 'iter_render'):
+            yield bound_field.as_widget(attrs=attrs)
+            return
+
+        attrs = dict(attrs or {})
+        if bound_field.auto_id and 'id' not in widget.attrs:
+            attrs.setdefault('id', bound_field.auto_id)
+        for chunk in widget.iter_render(bound_field.html_name, bound_field.value(), attrs=attrs):
+            yield chunk
+
+    def _raw_instance(self, raw):
+        """
+        Returns the instance saving a raw document: only its primary key is
+        set and the changed fields are written with a targeted update.
+        """
+        son = {'_id': raw['_id']}
+        if '_cls' in raw:
+            son['_cls'] = raw['_cls']
+        instance = self._meta.document._from_son(son, created=False)
+        instance._adding = False
+        instance._only_fields = self.get_projection()
+        return instance
+
+    @classmethod
+    def load_raw(cls, *q_objs, **query):
+        """
+        Fetches the raw document matching the query, with only the fields
+        edited by this form, to bind a form with `raw=`. No document is built.
+        """
+        queryset = query.pop('queryset', None)
+        if queryset is None:
+            queryset = cls._meta.document.objects
+        return queryset.only(*cls.get_projection()).as_pymongo().get(*q_objs, **query)
+
+    @classmethod
+    def get_projection(cls):
+        """
+        Returns the paths of the document fields edited by this form, suitable
+        for `QuerySet.only()`. `field__subfield` specs become dotted paths.
+        """
+        return list(iter_plan_paths(cls._field_plan))
+
+    @classmethod
+    def get_validator(cls):
+        """
+        Returns the compiled validator of nested JSON data for this form,
+        see `mongoforms.validator`.
+        """
+        return get_validator(cls)
+
+    @classmethod
+    def load_instance(cls, *q_objs, **query):
+        """
+        Fetches the instance matching the query, loading only the fields
+        edited by this form. `save()` only writes these fields back, see
+        `_update_instance`.
+        """
+        queryset = query.pop('queryset', None)
+        if queryset is None:
+            queryset = cls._meta.document.objects
+        projection = cls.get_projection()
+        instance = queryset.only(*projection).get(*q_objs, **query)
+        instance._only_fields = projection
+        return instance
+
+    @instrumented('full_clean')
+    def full_clean(self):
+        super(MongoForm, self).full_clean()
+
+    @instrumented('render')
+    def _html_output(self, *args, **kwargs):
+        return super(MongoForm, self)._html_output(*args, **kwargs)
+
+    @instrumented('save')
     def save(self, commit=True):
-        """save the instance or create a new one.."""
+        """
+        save the instance or create a new one.. Only the fields whose value
+        changed are set on an existing instance and written to the database,
+        their names are available afterwards as `changed_fields`. The lists
+        edited through a formset only get their changed items written, see
+        `utils.array_updates`: then the instance isn't saved with
+        `Document.save()` but validated and written by the form, which sends
+        the same signals (see `_update_instance`).
+        """
 
         # walk through the document fields
-        for field_name, field in iter_valid_fields(self._meta):
-            setattr(self.instance, field_name, self.cleaned_data.get(field_name))
+        self.changed_fields = []
+        item_updates = {}
+        for field_name, field, _, is_reference_list, _ in self._field_plan:
+            value = self.cleaned_data.get(field_name)
+            if self.instance._adding:
+                setattr(self.instance, field_name, value)
+                self.changed_fields.append(field_name)
+                continue
+
+            stored = self._stored_values.get(field_name)
+            mongo = mongo_value(field, value)
+            if mongo == stored:
+                continue
+            self.changed_fields.append(field_name)
+            updates = commit and not is_reference_list and isinstance(value, RowList) and \
+                isinstance(stored, list) and array_updates(field.db_field, stored, mongo, value.origins)
+            if updates:
+                # written by `_update_items`, not tracked as a change of the instance
+                self.instance._data[field_name] = value
+                item_updates[field_name] = updates
+            else:
+                setattr(self.instance, field_name, value)
 
         if commit:
-            self.instance.save()
+            if self.instance._adding:
+                self.instance.save()
+            elif not self.changed_fields:
+                # nothing to write
+                pass
+            elif item_updates or getattr(self.instance, '_only_fields', None):
+                # items of lists or a partially loaded instance, written by the form
+                self._update_instance(self.changed_fields, item_updates)
+            else:
+                # mongoengine only $set/$unset the changed fields
+                self.instance.save()
 
         return self.instance
 
-
-def mongoform_factory(embedded_document, extra_bases=None, extra_attrs=None, extra_meta=None):
+    def _update_items(self, item_updates):
+        """
+        write the updates of the lists' items with one bulk write. Each update
+        only matches the array of the length it expects, if one didn't (the
+        list was changed meanwhile) the whole lists are set.
+        """
+        document = self.instance.__class__
+        pk = document._fields[document._meta['id_field']].to_mongo(self.instance.pk)
+        requests = []
+        for field_name, updates in item_updates.items():
+            db_field = document._fields[field_name].db_field
+            requests.extend([UpdateOne({'_id': pk, db_field: {'$size': size}}, update)
+                             for size, update in updates])
+
+        collection = document._get_collection()
+        if collection.bulk_write(requests).matched_count != len(requests):
+            collection.update_one({'_id': pk}, {'$set': dict(
+                (document._fields[field_name].db_field,
+                 document._fields[field_name].to_mongo(self.instance._data[field_name]))
+                for field_name in item_updates)})
+
+    def _update_instance(self, field_names, item_updates=None):
+        """
+        write the given fields of an existing instance, without
+        `Document.save()`: the lists of `item_updates` with `_update_items`,
+        the other fields with one update. Of an embedded document edited with
+        `field__subfield` specs only the subfields are written. The save
+        signals are sent as `Document.save()` does and a complete instance is
+        validated, a partially loaded one isn't: its `validate()` and
+        `clean()` would fail on the fields which weren't loaded, the loaded
+        ones were validated by the form. The other fields changed by
+        `clean()` or the `pre_save` handlers are written as a whole.
+        """
+        document = self.instance.__class__
+        item_updates = item_updates or {}
+        signals.pre_save.send(document, document=self.instance)
+        if not getattr(self.instance, '_only_fields', None):
+            self.instance.validate()
+        signals.pre_save_post_validation.send(document, document=self.instance, created=False)
+
+        update = {}
+        for entry in self._field_plan:
+            if entry.name in field_names and entry.name not in item_updates:
+                update.update(iter_plan_updates(entry, getattr(self.instance, entry.name)))
+        changed = set(path.split('.')[0] for path in self.instance._get_changed_fields())
+        for field_name, field in document._fields.items():
+            if field.db_field in changed and field_name not in field_names:
+                value = getattr(self.instance, field_name)
+                if value is None:
+                    update['unset__' + field_name] = 1
+                else:
+                    update['set__' + field_name] = value
+
+        if update:
+            document.objects(pk=self.instance.pk).update_one(**update)
+        if item_updates:
+            self._update_items(item_updates)
+        self.instance._clear_changed_fields()
+        signals.post_save.send(document, document=self.instance, created=False)
+
+
+# classes built by mongoform_factory, see `clear_mongoform_factory_cache`
+_mongoform_factory_cache = {}
+
+
+class _NotCachable(Exception):
+    pass
+
+
+def _cache_key(value):
+    """
+    Returns a hashable key for a factory argument, compared by value. Raises
+    `_NotCachable` for anything else (e.g. overridden form fields or a default
+    built per call), such calls can't be told apart by the cache.
+    """
+    if value is None or isinstance(value, (basestring, int, long, float, type)):
+        return value
+    elif isinstance(value, (tuple, list)):
+        return tuple([_cache_key(v) for v in value])
+    elif isinstance(value, dict):
+        return tuple(sorted([(k, _cache_key(v)) for k, v in value.items()]))
+    raise _NotCachable(value)
+
+
+def clear_mongoform_factory_cache():
+    """forget the classes generated by mongoform_factory.."""
+    _mongoform_factory_cache.clear()
+
+
+def mongoform_factory(embedded_document, extra_bases=None, extra_attrs=None, extra_meta=None,
+                      cache=True):
+    """
+    Builds a MongoForm class for the given document. Classes are cached per
+    process, so equal calls (same document, bases, meta and attributes)
+    return the same class. Calls with other values than plain ones, e.g.
+    overridden form fields, build a new class each time.
+    """
+    if cache:
+        try:
+            key = (embedded_document, _cache_key(extra_bases),
+                   _cache_key(extra_attrs), _cache_key(extra_meta))
+        except _NotCachable:
+            return mongoform_factory(embedded_document, extra_bases, extra_attrs, extra_meta,
+                                     cache=False)
+        if key not in _mongoform_factory_cache:
+            _mongoform_factory_cache[key] = mongoform_factory(embedded_document,
+                extra_bases, extra_attrs, extra_meta, cache=False)
+        return _mongoform_factory_cache[key]
 
     bases = (MongoForm, )
 
@@ -0,0 +1,257 @@
+from django import forms, VERSION as django_version
+from django.forms.forms import NON_FIELD_ERRORS
+from django.forms.formsets import formset_factory
+from django.utils.translation import ugettext as _
+
+if django_version < (1, 9):
+    from django.forms.util import ErrorList
+else:
+    from django.forms.utils import ErrorList
+
+from bson.errors import InvalidId
+from mongoengine.errors import ValidationError
+from mongoengine.queryset import transform
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import get_choice_cache
+from fields import MongoFormFormSet
+from forms import mongoform_factory
+from utils import iter_plan_updates
+
+__all__ = ('BaseMongoFormSet', 'mongoformset_factory')
+
+# hidden field matching the rows of existing documents back to them
+PK_FIELD_NAME = 'pk'
+
+
+def update_document(form, field_names):
+    """
+    the raw update writing the given fields of the form's instance.. Of an
+    embedded document edited with `field__subfield` specs only the subfields
+    are written, see `utils.iter_plan_updates`.
+    """
+    update = {}
+    for entry in form._field_plan:
+        if entry.name in field_names:
+            update.update(iter_plan_updates(entry, getattr(form.instance, entry.name)))
+    return transform.update(form.instance.__class__, **update)
+
+
+def bulk_write_errors(write, requests):
+    """
+    Runs an unordered bulk write (`insert_many` or `bulk_write`) and returns
+    the error messages by request index, the other requests are written.
+    """
+    if not requests:
+        return {}
+    try:
+        write(requests, ordered=False)
+    except BulkWriteError, e:
+        return dict((error['index'], error['errmsg']) for error in e.details['writeErrors'])
+    return {}
+
+
+class BaseMongoFormSet(MongoFormFormSet):
+    """
+    A formset of MongoForms over many documents of the same class, see
+    `mongoformset_factory`. The rows of existing documents come from
+    `queryset` (all the documents by default), only the fields of the form
+    are loaded.
+
+    `save()` inserts the new documents with one `insert_many` and writes the
+    changed fields of the others with one `bulk_write`, no save signal is
+    sent but the shared choice cache of the document class is invalidated.
+    A row whose write failed gets the error as a non field error, so
+    `is_valid()` is False afterwards.
+    """
+    queryset = None
+
+    def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
+                 queryset=None, initial=None, error_class=ErrorList, **kwargs):
+        if queryset is not None:
+            self.queryset = queryset
+        self._objects = None
+        self._objects_by_pk = None
+        super(BaseMongoFormSet, self).__init__(data=data, files=files, auto_id=auto_id,
+            prefix=prefix, initial=initial, error_class=error_class, **kwargs)
+
+    @property
+    def document(self):
+        return self.form._meta.document
+
+    def get_queryset(self):
+        queryset = self.queryset
+        if queryset is None:
+            queryset = self.document.objects
+        return queryset.clone().only(*self.form.get_projection())
+
+    def get_objects(self):
+        """
+        Returns the existing documents. An unbound formset loads the
+        queryset, a bound one only the documents whose pk was posted.
+        """
+        if self._objects is None:
+            queryset = self.get_queryset()
+            if self.is_bound:
+                pks = [self.data.get(self._pk_key(i)) for i in xrange(self.initial_form_count())]
+                queryset = queryset.filter(pk__in=self._valid_pks(pks))
+            self._objects = []
+            for obj in queryset:
+                obj._only_fields = self.form.get_projection()
+                self._objects.append(obj)
+        return self._objects
+
+    def _valid_pks(self, pks):
+        """
+        the posted pks converted for the query, invalid ones are left out and
+        their rows get the unknown pk error..
+        """
+        id_field = self.document._fields[self.document._meta['id_field']]
+        valid_pks = []
+        for pk in pks:
+            if not pk:
+                continue
+            try:
+                pk = id_field.to_python(pk)
+                id_field.validate(pk)
+            except (InvalidId, ValidationError, TypeError, ValueError):
+                continue
+            valid_pks.append(pk)
+        return valid_pks
+
+    def _pk_key(self, i):
+        return '%s-%s' % (self.add_prefix(i), PK_FIELD_NAME)
+
+    def _existing_object(self, i):
+        if not self.is_bound:
+            return self.get_objects()[i]
+        if self._objects_by_pk is None:
+            self._objects_by_pk = dict((unicode(obj.pk), obj) for obj in self.get_objects())
+        return self._objects_by_pk.get(self.data.get(self._pk_key(i)))
+
+    def initial_form_count(self):
+        if not self.is_bound:
+            return len(self.get_objects())
+        return super(BaseMongoFormSet, self).initial_form_count()
+
+    def _construct_form(self, i, **kwargs):
+        if i < self.initial_form_count():
+            kwargs['instance'] = self._existing_object(i)
+        return super(BaseMongoFormSet, self)._construct_form(i, **kwargs)
+
+    def add_fields(self, form, index):
+        super(BaseMongoFormSet, self).add_fields(form, index)
+        if index is not None and index < self.initial_form_count():
+            instance = None if form.instance._adding else form.instance
+            form.fields[PK_FIELD_NAME] = forms.CharField(widget=forms.HiddenInput,
+                initial=instance and unicode(instance.pk),
+                validators=[lambda value: self._validate_pk(instance)])
+
+    def _validate_pk(self, instance):
+        if instance is None:
+            raise forms.ValidationError(
+                _(u'Select a valid choice. That choice is not one of the available choices.'))
+
+    def save(self, commit=True):
+        """
+        Saves the rows of a valid formset and returns the new and changed
+        instances. Rows marked for deletion are deleted with one query.
+        """
+        self.new_objects = []
+        self.changed_objects = []
+        self.deleted_objects = []
+
+        for form in self.forms:
+            if form.instance._adding and not form.has_changed():
+                # empty extra row
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                if not form.instance._adding:
+                    self.deleted_objects.append(form.instance)
+                continue
+            form.save(commit=False)
+            if form.instance._adding:
+                self.new_objects.append(form)
+            elif form.changed_fields:
+                self.changed_objects.append(form)
+
+        if commit:
+            self._insert(self.new_objects)
+            self._update(self.changed_objects)
+            if self.deleted_objects:
+                self.document.objects(pk__in=[obj.pk for obj in self.deleted_objects]).delete()
+            choice_cache = get_choice_cache()
+            if choice_cache is not None and (
+                    self.new_objects or self.changed_objects or self.deleted_objects):
+                # the bulk writes send no signal
+                choice_cache.invalidate(self.document)
+
+        self.new_objects = [form.instance for form in self.new_objects]
+        self.changed_objects = [form.instance for form in self.changed_objects]
+        return self.new_objects + self.changed_objects
+
+    def _insert(self, rows):
+        """insert the new instances of the rows, keeps the inserted rows.."""
+        valid_rows = []
+        for form in rows:
+            try:
+                form.instance.validate()
+            except ValidationError, e:
+                self._add_row_error(form, e)
+                continue
+            valid_rows.append(form)
+
+        docs = [form.instance.to_mongo() for form in valid_rows]
+        errors = bulk_write_errors(self.document._get_collection().insert_many, docs)
+
+        id_field = self.document._meta['id_field']
+        rows[:] = []
+        for index, (form, doc) in enumerate(zip(valid_rows, docs)):
+            if index in errors:
+                self._add_row_error(form, errors[index])
+                continue
+            # insert_many sets the generated _id on the documents
+            setattr(form.instance, id_field, self.document._fields[id_field].to_python(doc['_id']))
+            form.instance._created = False
+            form.instance._adding = False
+            form.instance._clear_changed_fields()
+            rows.append(form)
+
+    def _update(self, rows):
+        """write the changed fields of the rows, keeps the updated rows.."""
+        id_field = self.document._fields[self.document._meta['id_field']]
+        requests = [UpdateOne({'_id': id_field.to_mongo(form.instance.pk)},
+                              update_document(form, form.changed_fields))
+                    for form in rows]
+        errors = bulk_write_errors(self.document._get_collection().bulk_write, requests)
+
+        updated_rows = []
+        for index, form in enumerate(rows):
+            if index in errors:
+                self._add_row_error(form, errors[index])
+                continue
+            form.instance._clear_changed_fields()
+            updated_rows.append(form)
+        rows[:] = updated_rows
+
+    def _add_row_error(self, form, message):
+        form._errors.setdefault(NON_FIELD_ERRORS, form.error_class()).append(unicode(message))
+
+
+def mongoformset_factory(document, form=None, formset=BaseMongoFormSet, extra=1,
+                         can_delete=False, can_order=False, max_num=None,
+                         fields=None, exclude=None):
+    """
+    Returns a formset class editing many documents of the given class, the
+    form defaults to a `mongoform_factory` form with the given fields.
+    """
+    if form is None:
+        extra_meta = {}
+        if fields is not None:
+            extra_meta['fields'] = fields
+        if exclude is not None:
+            extra_meta['exclude'] = exclude
+        form = mongoform_factory(document, extra_meta=extra_meta)
+    return formset_factory(form, formset=formset, extra=extra, can_delete=can_delete,
+                           can_order=can_order, max_num=max_num)
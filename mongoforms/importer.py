@@ -0,0 +1,153 @@
+import csv
+import json
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+from mongoengine.errors import ValidationError
+
+from formsets import bulk_write_errors
+
+__all__ = ('read_records', 'import_records', 'ImportResult')
+
+# key of the values of a CSV line beyond the header's columns
+EXTRA_COLUMNS = '__extra__'
+
+
+def read_records(stream, format='csv'):
+    """
+    Yields the records of a CSV (with a header line) or JSON lines stream
+    one at a time, as dicts of form data. The values of a CSV line with
+    more columns than the header are kept under `EXTRA_COLUMNS`, the record
+    is rejected by `import_records`.
+    """
+    if format == 'csv':
+        for row in csv.DictReader(stream, restkey=EXTRA_COLUMNS):
+            record = {}
+            for key, value in row.items():
+                if key == EXTRA_COLUMNS:
+                    record[key] = [extra.decode('utf-8') for extra in value]
+                elif value is not None:
+                    record[key.decode('utf-8')] = value.decode('utf-8')
+            yield record
+    elif format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('unknown record format %r' % format)
+
+
+def validate_records(form_class, start, records):
+    """
+    Validates the records through the form, returns a `(number, document,
+    errors)` tuple per record: the document to insert as a SON, or None with
+    the form errors.
+    """
+    results = []
+    for number, record in enumerate(records, start):
+        if EXTRA_COLUMNS in record:
+            results.append((number, None, {'__all__': [
+                u'%d values beyond the header' % len(record[EXTRA_COLUMNS])]}))
+            continue
+        form = form_class(record)
+        if not form.is_valid():
+            results.append((number, None, dict(
+                (field, [unicode(e) for e in errors]) for field, errors in form.errors.items())))
+            continue
+        instance = form.save(commit=False)
+        try:
+            instance.validate()
+        except ValidationError, e:
+            results.append((number, None, {'__all__': [unicode(e)]}))
+            continue
+        results.append((number, instance.to_mongo(), None))
+    return results
+
+
+def _validate_chunk(args):
+    return validate_records(*args)
+
+
+class ImportResult(object):
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+
+
+def _iter_chunks(records, chunk_size):
+    """yields (number of the first record, records) chunks.."""
+    records = iter(records)
+    start = 1
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def _iter_validated(form_class, records, chunk_size, processes, initializer):
+    """
+    Yields the validated chunks in order. With a pool at most two chunks per
+    process are in flight, so the records are still read lazily.
+    """
+    chunks = _iter_chunks(records, chunk_size)
+    if not processes:
+        for start, chunk in chunks:
+            yield chunk, validate_records(form_class, start, chunk)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer)
+    try:
+        pending = deque()
+        for start, chunk in chunks:
+            pending.append((chunk, pool.apply_async(_validate_chunk, ((form_class, start, chunk),))))
+            if len(pending) >= processes * 2:
+                chunk, result = pending.popleft()
+                yield chunk, result.get()
+        while pending:
+            chunk, result = pending.popleft()
+            yield chunk, result.get()
+    finally:
+        pool.terminate()
+
+
+def import_records(form_class, records, chunk_size=500, processes=None,
+                   errors=None, initializer=None):
+    """
+    Validates the records (dicts of form data, e.g. from `read_records`)
+    through a MongoForm class and inserts the valid ones, one `insert_many`
+    per chunk, without save signals. Memory is bounded by the chunk size
+    whatever the number of records.
+
+    `processes` fans the validation out to a process pool, the form class
+    must then be importable and `initializer` may reconnect the workers to
+    the database for forms querying it (e.g. reference fields). Rejected
+    records are written to the `errors` file as JSON lines with their number
+    (from 1), data and errors. Returns an `ImportResult` with the counts.
+    """
+    collection = form_class._meta.document._get_collection()
+    result = ImportResult()
+
+    for chunk, validated in _iter_validated(form_class, records, chunk_size,
+                                            processes, initializer):
+        result.read += len(chunk)
+        docs = [(number, doc) for number, doc, _ in validated if doc is not None]
+        rejects = [(number, form_errors) for number, doc, form_errors in validated
+                   if doc is None]
+
+        write_errors = bulk_write_errors(collection.insert_many, [doc for _, doc in docs])
+        for index, message in write_errors.items():
+            rejects.append((docs[index][0], {'__all__': [message]}))
+        result.inserted += len(docs) - len(write_errors)
+        result.rejected += len(rejects)
+
+        if errors is not None:
+            start = validated[0][0]
+            for number, form_errors in sorted(rejects):
+                errors.write(json.dumps({'record': number, 'data': chunk[number - start],
+                                         'errors': form_errors}) + '\n')
+
+    return result
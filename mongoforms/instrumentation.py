@@ -0,0 +1,192 @@
+"""
+Opt-in timing of the MongoForm phases. Nothing is measured until a
+collector is added::
+
+    from mongoforms import instrumentation
+    instrumentation.install_query_counter()     # before connecting
+    instrumentation.add_collector(instrumentation.LoggingCollector())
+
+Each measure is a `Record` of the form instance (the class name for the
+'class' phase), the phase, the field name or None, the wall time in seconds
+and the number of database commands, or None without the query counter.
+
+The phases are 'class' (field generation of a class), 'init' (initial data
+of an instance), 'full_clean', 'clean' and 'validate' per field (form field
+and mongoengine validation), 'formset' per field (parsing the rows),
+'lookup' (reference queries), 'render' (the whole form and per formset
+field) and 'save'. Phases nest, e.g. 'lookup' records are part of a 'clean'.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+
+__all__ = ('Record', 'add_collector', 'remove_collector', 'install_query_counter',
+           'LoggingCollector', 'StatsdCollector', 'ListCollector')
+
+Record = namedtuple('Record', ('form', 'phase', 'field', 'duration', 'queries'))
+
+# the collectors, replaced rather than mutated so that readers need no lock
+_collectors = ()
+_state = threading.local()
+_query_counter = None
+
+
+def add_collector(collector):
+    """start sending records to the collector, an object with a `record(record)` method.."""
+    global _collectors
+    _collectors = _collectors + (collector,)
+
+
+def remove_collector(collector):
+    global _collectors
+    _collectors = tuple([c for c in _collectors if c is not collector])
+
+
+def install_query_counter():
+    """
+    Counts the database commands of each thread through pymongo command
+    monitoring. Only the clients connected afterwards are monitored.
+    """
+    global _query_counter
+    if _query_counter is None:
+        from pymongo import monitoring
+
+        class QueryCounter(monitoring.CommandListener):
+            def started(self, event):
+                _state.queries = getattr(_state, 'queries', 0) + 1
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+
+        _query_counter = QueryCounter()
+        monitoring.register(_query_counter)
+
+
+def _queries():
+    if _query_counter is None:
+        return None
+    return getattr(_state, 'queries', 0)
+
+
+class _Timer(object):
+    __slots__ = ('form', 'phase', 'field', 'start', 'queries')
+
+    def __init__(self, form, phase, field):
+        self.form = form
+        self.phase = phase
+        self.field = field
+
+    def __enter__(self):
+        stack = _state.__dict__.setdefault('forms', [])
+        if self.form is None:
+            self.form = stack[-1] if stack else None
+        stack.append(self.form)
+        self.queries = _queries()
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        duration = time.time() - self.start
+        _state.forms.pop()
+        queries = None if self.queries is None else _queries() - self.queries
+        record = Record(self.form, self.phase, self.field, duration, queries)
+        for collector in _collectors:
+            collector.record(record)
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_timer = _NoTimer()
+
+
+def timed(form, phase, field=None):
+    """
+    Context manager recording a phase, a no-op without collectors. Without
+    a form the record belongs to the enclosing phase's form.
+    """
+    if not _collectors:
+        return _no_timer
+    return _Timer(form, phase, field)
+
+
+def instrumented(phase):
+    """decorates a form method recorded as the given phase.."""
+    def decorator(method):
+        @wraps(method)
+        def inner(self, *args, **kwargs):
+            with timed(self, phase):
+                return method(self, *args, **kwargs)
+        return inner
+    return decorator
+
+
+def form_name(form):
+    if form is None:
+        return 'none'
+    if isinstance(form, basestring):
+        return form
+    return form.__class__.__name__
+
+
+class LoggingCollector(object):
+    """logs each record, to the 'mongoforms.timing' logger by default.."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('mongoforms.timing')
+        self.level = level
+
+    def record(self, record):
+        self.logger.log(self.level, '%s %s%s %.2fms %s queries', form_name(record.form),
+                        record.phase, record.field and ' %s' % record.field or '',
+                        record.duration * 1000, record.queries)
+
+
+class StatsdCollector(object):
+    """
+    Sends `<prefix>.<form>.<phase>[.<field>]` timings and `.queries` counts
+    to a statsd client (anything with `timing(stat, ms)` and `incr(stat,
+    count)`).
+    """
+
+    def __init__(self, client, prefix='mongoforms'):
+        self.client = client
+        self.prefix = prefix
+
+    def record(self, record):
+        stat = '.'.join([self.prefix, form_name(record.form), record.phase] +
+                        (record.field and [record.field] or []))
+        self.client.timing(stat, record.duration * 1000)
+        if record.queries:
+            self.client.incr(stat + '.queries', record.queries)
+
+
+class ListCollector(object):
+    """
+    Keeps the records of the current thread between `start()` and `stop()`,
+    e.g. for the duration of a request.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = getattr(self._local, 'records', None) or []
+        self._local.records = None
+        return records
+
+    def record(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is not None:
+            records.append(record)
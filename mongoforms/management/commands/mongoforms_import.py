@@ -0,0 +1,67 @@
+import sys
+from importlib import import_module
+from optparse import make_option
+
+from django import VERSION as django_version
+from django.core.management.base import BaseCommand, CommandError
+
+from mongoforms.importer import read_records, import_records
+
+OPTIONS = (
+    (('--format',), dict(dest='format', default=None,
+        help='csv or jsonl, guessed from the file extension by default')),
+    (('--chunk-size',), dict(dest='chunk_size', default=500,
+        help='records validated and inserted at once')),
+    (('--processes',), dict(dest='processes', default=0,
+        help='validate in a pool of processes')),
+    (('--errors',), dict(dest='errors', default=None,
+        help='write the rejected records to this file (JSON lines)')),
+)
+
+
+def import_form(path):
+    module_name, _, class_name = path.rpartition('.')
+    try:
+        return getattr(import_module(module_name), class_name)
+    except (ImportError, AttributeError, ValueError), e:
+        raise CommandError('cannot import the form %s: %s' % (path, e))
+
+
+class Command(BaseCommand):
+    help = 'Imports CSV or JSON lines records validated through a MongoForm.'
+    args = '<form class path> <file, - for stdin>'
+
+    if django_version < (1, 8):
+        option_list = BaseCommand.option_list + tuple(
+            [make_option(*flags, **kwargs) for flags, kwargs in OPTIONS])
+    else:
+        def add_arguments(self, parser):
+            parser.add_argument('form')
+            parser.add_argument('path')
+            for flags, kwargs in OPTIONS:
+                parser.add_argument(*flags, **kwargs)
+
+    def handle(self, *args, **options):
+        if args:
+            if len(args) != 2:
+                raise CommandError('usage: %s' % self.args)
+            form_path, path = args
+        else:
+            form_path, path = options['form'], options['path']
+        form_class = import_form(form_path)
+
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        stream = sys.stdin if path == '-' else open(path, 'rb')
+        errors = options['errors'] and open(options['errors'], 'w')
+        try:
+            result = import_records(form_class, read_records(stream, format),
+                chunk_size=int(options['chunk_size']), processes=int(options['processes']),
+                errors=errors)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if errors:
+                errors.close()
+
+        self.stdout.write('%d records read, %d inserted, %d rejected\n' % (
+            result.read, result.inserted, result.rejected))
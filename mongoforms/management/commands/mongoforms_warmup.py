@@ -0,0 +1,35 @@
+import time
+from optparse import make_option
+
+from django import VERSION as django_version
+from django.core.management.base import BaseCommand
+
+from mongoforms.forms import warm_up
+from mongoforms.prefork import import_forms_modules
+
+OPTIONS = (
+    (('--module',), dict(dest='modules', action='append', default=[],
+        help='also import this module, may be repeated')),
+)
+
+
+class Command(BaseCommand):
+    help = 'Generates the fields of every MongoForm class and reports the build times.'
+
+    if django_version < (1, 8):
+        option_list = BaseCommand.option_list + tuple(
+            [make_option(*flags, **kwargs) for flags, kwargs in OPTIONS])
+    else:
+        def add_arguments(self, parser):
+            for flags, kwargs in OPTIONS:
+                parser.add_argument(*flags, **kwargs)
+
+    def handle(self, *args, **options):
+        import_forms_modules(options['modules'])
+        start = time.time()
+        timings = warm_up()
+        total = time.time() - start
+        for form_class, seconds in sorted(timings, key=lambda t: -t[1]):
+            self.stdout.write('%8.2fms  %s.%s\n' % (seconds * 1000,
+                form_class.__module__, form_class.__name__))
+        self.stdout.write('%d classes built in %.2fms\n' % (len(timings), total * 1000))
@@ -0,0 +1,46 @@
+from debug_toolbar.panels import Panel
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from mongoforms import instrumentation
+
+
+class MongoFormsPanel(Panel):
+    """
+    django-debug-toolbar panel listing the timed MongoForm phases of the
+    request, enabled by adding 'mongoforms.panels.MongoFormsPanel' to
+    `DEBUG_TOOLBAR_PANELS`. Query counts need
+    `instrumentation.install_query_counter()`.
+    """
+    title = 'MongoForms'
+    template = None
+
+    def __init__(self, *args, **kwargs):
+        super(MongoFormsPanel, self).__init__(*args, **kwargs)
+        self.collector = instrumentation.ListCollector()
+        self.records = []
+
+    def enable_instrumentation(self):
+        self.collector.start()
+        instrumentation.add_collector(self.collector)
+
+    def disable_instrumentation(self):
+        instrumentation.remove_collector(self.collector)
+        self.records = self.collector.stop()
+
+    @property
+    def nav_subtitle(self):
+        forms = set([id(r.form) for r in self.records if r.phase == 'init'])
+        return '%d forms' % len(forms)
+
+    @property
+    def content(self):
+        rows = []
+        for record in self.records:
+            rows.append('<tr><td>%s</td><td>%s</td><td>%s</td><td>%.2f</td><td>%s</td></tr>' % (
+                escape(instrumentation.form_name(record.form)), escape(record.phase),
+                escape(record.field or ''), record.duration * 1000,
+                '' if record.queries is None else record.queries))
+        return mark_safe('<table><thead><tr><th>Form</th><th>Phase</th><th>Field</th>'
+                         '<th>Time (ms)</th><th>Queries</th></tr></thead>'
+                         '<tbody>%s</tbody></table>' % ''.join(rows))
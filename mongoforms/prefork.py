@@ -0,0 +1,167 @@
+"""
+Warm-up of a forking server's master process, so that the workers share the
+generated MongoForm classes instead of each building them after the fork.
+With gunicorn, in the configuration file::
+
+    def on_starting(server):
+        from mongoforms.prefork import preload
+        server.log.info(preload(prime_choices=True, freeze=True))
+
+    def post_fork(server, worker):
+        from mongoforms.prefork import unfreeze_gc
+        unfreeze_gc()
+
+`freeze=True` keeps the collector from touching the shared pages until
+the fork, the workers must then restore the collection with `unfreeze_gc`.
+
+The database connection opened to prime the choices must not be used by the
+workers, connect with `connect=False` or reconnect after the fork.
+"""
+import gc
+import resource
+import time
+from collections import namedtuple
+from importlib import import_module
+
+from django.conf import settings
+from django.utils.module_loading import module_has_submodule
+
+from cache import get_choice_cache
+from fields import ReferenceField, ReferenceSearchWidget
+from forms import warm_up, _form_classes
+
+__all__ = ('preload', 'unfreeze_gc', 'PreloadReport')
+
+# the thresholds changed by `freeze_gc`, inherited by the forked workers
+_frozen_threshold = None
+
+
+class PreloadReport(namedtuple('PreloadReport',
+                               ('classes', 'seconds', 'choices', 'rss_before', 'rss_after'))):
+    """
+    What `preload` built. The resident memory grown meanwhile is what each
+    worker shares rather than builds again.
+    """
+
+    @property
+    def saved(self):
+        if self.rss_before is None:
+            return None
+        return self.rss_after - self.rss_before
+
+    def __str__(self):
+        saved = 'unknown' if self.saved is None else '%.1fMB' % (self.saved / 1048576.)
+        return 'mongoforms: %d form classes built in %.2fs, %d choice lists primed, ' \
+               '%s shared per worker' % (self.classes, self.seconds, self.choices, saved)
+
+
+def get_app_names():
+    try:
+        from django.apps import apps
+    except ImportError:
+        return list(settings.INSTALLED_APPS)
+    return [app_config.name for app_config in apps.get_app_configs()]
+
+
+def import_forms_modules(extra_modules=()):
+    """import the forms module of every installed app and the given modules.."""
+    for app_name in get_app_names():
+        app_module = import_module(app_name)
+        if module_has_submodule(app_module, 'forms'):
+            import_module('%s.forms' % app_name)
+    for module_name in extra_modules:
+        import_module(module_name)
+
+
+def resident_memory():
+    """the resident memory of the process in bytes, None where unknown.."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def iter_reference_fields(fields):
+    """walks the reference fields, including those of embedded forms.."""
+    for field in fields.values():
+        if isinstance(field, ReferenceField):
+            yield field
+        form_cls = getattr(field, 'form_cls', None) or getattr(field.widget, 'form_cls', None)
+        if form_cls is not None:
+            for reference_field in iter_reference_fields(form_cls.base_fields):
+                yield reference_field
+
+
+def prime_choice_caches():
+    """
+    Fills the choice cache (see `MONGOFORMS_CHOICE_CACHE_TTL`) with the
+    choices of the built forms' reference fields, returns how many lists
+    were fetched.
+    """
+    cache = get_choice_cache()
+    if cache is None:
+        return 0
+    keys = set()
+    for form_class in list(_form_classes):
+        if not form_class.is_built():
+            continue
+        for field in iter_reference_fields(form_class.base_fields):
+            if isinstance(field.widget, ReferenceSearchWidget) or hasattr(field, '_choices'):
+                # only the selected document is rendered, or fixed choices
+                continue
+            key = cache.get_key(field.queryset)
+            if key not in keys:
+                keys.add(key)
+                cache.get_choices(field.queryset)
+    return len(keys)
+
+
+def freeze_gc():
+    """
+    Keeps the garbage collector from writing to the pages of the objects
+    alive so far. Python 2 has no `gc.freeze()`, the objects are moved to
+    the oldest generation and its full collections are made very rare, the
+    younger generations are still collected as usual. Cyclic garbage
+    reaching the oldest generation isn't collected until `unfreeze_gc`.
+    """
+    global _frozen_threshold
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    else:
+        _frozen_threshold = gc.get_threshold()
+        threshold0, threshold1, _ = _frozen_threshold
+        gc.set_threshold(threshold0, threshold1, 1000000)
+
+
+def unfreeze_gc():
+    """
+    Restores the full collections made rare by `freeze_gc`, call it in each
+    worker after the fork (with gunicorn in `post_fork`). The objects frozen
+    before the fork stay shared until they are collected.
+    """
+    global _frozen_threshold
+    if _frozen_threshold is not None:
+        gc.set_threshold(*_frozen_threshold)
+        _frozen_threshold = None
+
+
+def preload(modules=(), prime_choices=False, freeze=False):
+    """
+    Imports the forms modules of the installed apps and the given modules,
+    builds every MongoForm class with the embedded form and formset classes
+    they generate, optionally primes the reference choice caches and
+    freezes the garbage collector, see `unfreeze_gc`. Call it in the master
+    process before forking, returns a `PreloadReport`.
+    """
+    rss_before = resident_memory()
+    start = time.time()
+    import_forms_modules(modules)
+    classes = len(warm_up())
+    choices = prime_choices and prime_choice_caches() or 0
+    seconds = time.time() - start
+    if freeze:
+        freeze_gc()
+    rss_after = resident_memory()
+    return PreloadReport(classes, seconds, choices, rss_before, rss_after)
@@ -0,0 +1,69 @@
+/*
+ * Client side management of the formsets rendered by
+ * `mongoforms.fields.FormsetInput`, included through the widget's media.
+ * Everything is driven by data attributes:
+ *
+ *   <ul data-formset="prefix" data-formset-row-class="...">  the rows
+ *   <a data-formset-add="prefix">      appends a row built from #empty_prefix
+ *   <a data-formset-remove>            marks its row as deleted and hides it
+ *   <a data-formset-move="up|down">    moves its row and renumbers the rows
+ *
+ * The remove and move links are rendered in each editable row.
+ */
+(function($) {
+  function escapeRegExp(value) {
+    return value.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+  }
+
+  // the ORDER input of a row of the formset, not of the nested ones
+  function orderInput($row, prefix) {
+    var name = new RegExp('^' + escapeRegExp(prefix) + '-[^-]+-ORDER$');
+    return $row.find('input').filter(function() {
+      return name.test(this.name);
+    }).first();
+  }
+
+  function renumber($list) {
+    var prefix = $list.attr('data-formset');
+    $list.children('li').each(function(index) {
+      orderInput($(this), prefix).val(index + 1);
+    });
+  }
+
+  $(document).on('click', '[data-formset-add]', function(event) {
+    event.preventDefault();
+    var prefix = $(this).attr('data-formset-add');
+    var $total = $('#id_' + prefix + '-TOTAL_FORMS');
+    var num = parseInt($total.val() || 0, 10);
+    $total.val(num + 1);
+
+    var $list = $('ul[data-formset="' + prefix + '"]');
+    var html = $('#empty_' + prefix).html().replace(
+      new RegExp(escapeRegExp(prefix) + '-__prefix__', 'g'), prefix + '-' + num);
+    var $row = $('<li>' + html + '</li>');
+    $row.addClass($list.attr('data-formset-row-class') || '').appendTo($list);
+    orderInput($row, prefix).val(num + 1);
+  });
+
+  $(document).on('click', '[data-formset-remove]', function(event) {
+    event.preventDefault();
+    var $row = $(this).closest('ul[data-formset] > li');
+    var prefix = $row.parent().attr('data-formset');
+    var name = new RegExp('^' + escapeRegExp(prefix) + '-[^-]+-DELETE$');
+    $row.find('input').filter(function() {
+      return name.test(this.name);
+    }).prop('checked', true);
+    $row.hide();
+  });
+
+  $(document).on('click', '[data-formset-move]', function(event) {
+    event.preventDefault();
+    var $row = $(this).closest('ul[data-formset] > li');
+    if ($(this).attr('data-formset-move') === 'up') {
+      $row.insertBefore($row.prev());
+    } else {
+      $row.insertAfter($row.next());
+    }
+    renumber($row.parent());
+  });
+})(jQuery);
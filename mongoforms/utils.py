@@ -1,14 +1,21 @@
+from collections import Mapping, namedtuple
+
 from django import forms
 from django.core.validators import EMPTY_VALUES
 
 from mongoengine.errors import ValidationError
+from mongoengine.base import BaseDocument
 from mongoengine.base.fields import ObjectIdField
+from mongoengine.fields import EmbeddedDocumentField, ListField, ReferenceField
 
+from bson.dbref import DBRef
 from bson.son import SON
 from UserDict import UserDict
 
+from mongoforms.instrumentation import timed
+
 
-def mongoengine_validate_wrapper(old_clean, new_clean, required):
+def mongoengine_validate_wrapper(old_clean, new_clean, required, field_name=None):
     """
     A wrapper function to validate formdata against mongoengine-field
     validator and raise a proper django.forms ValidationError if there
@@ -16,7 +23,8 @@ def mongoengine_validate_wrapper(old_clean, new_clean, required):
     """
 
     def inner_validate(value):
-        value = old_clean(value)
+        with timed(None, 'clean', field_name):
+            value = old_clean(value)
 
         if not required and value in EMPTY_VALUES:
             value = new_clean.im_self.default
@@ -25,7 +33,8 @@ def mongoengine_validate_wrapper(old_clean, new_clean, required):
             return value
 
         try:
-            new_clean(value)
+            with timed(None, 'validate', field_name):
+                new_clean(value)
             return value
         except ValidationError, e:
             raise forms.ValidationError(e)
@@ -58,6 +67,151 @@ def iter_valid_fields(meta):
                 field = meta.document._fields.get(field_name)
                 yield (field_name, field)
 
+FieldPlan = namedtuple('FieldPlan',
+    ('name', 'field', 'is_reference', 'is_reference_list', 'sub_plan'))
+
+def build_field_plan(meta):
+    """
+    Walks the valid fields once and returns them as an ordered tuple of
+    `FieldPlan` entries. `sub_plan` is the plan of the embedded document
+    fields selected with `field__subfield` specs, or None.
+    """
+    meta_fields = getattr(meta, 'fields', ())
+    plan = []
+    seen = set()
+    for field_name, field in iter_valid_fields(meta):
+        if field_name == '_cls' or field_name in seen:
+            continue
+        seen.add(field_name)
+
+        sub_plan = None
+        sub_fields = tuple([f.split('__', 1)[1] for f in meta_fields
+                            if f.startswith(field_name + '__')])
+        if sub_fields and field_name not in meta_fields:
+            if isinstance(field, ListField):
+                embedded_field = field.field
+            else:
+                embedded_field = field
+            if isinstance(embedded_field, EmbeddedDocumentField):
+                sub_plan = build_field_plan(type('Meta', (object,), {
+                    'document': embedded_field.document_type,
+                    'fields': sub_fields}))
+
+        plan.append(FieldPlan(field_name, field,
+            isinstance(field, ReferenceField),
+            isinstance(field, ListField) and isinstance(field.field, ReferenceField),
+            sub_plan))
+    return tuple(plan)
+
+def iter_plan_paths(plan, prefix=''):
+    """walk through the dotted document paths covered by a field plan.."""
+    for entry in plan:
+        if entry.sub_plan:
+            for path in iter_plan_paths(entry.sub_plan, prefix + entry.name + '.'):
+                yield path
+        else:
+            yield prefix + entry.name
+
+def iter_plan_updates(entry, value, prefix=''):
+    """
+    walk through the `set__`/`unset__` updates writing a field of a plan..
+    An embedded document edited with `field__subfield` specs is written
+    subfield by subfield, a list of them as a whole.
+    """
+    path = prefix + entry.name
+    if value is None:
+        yield 'unset__' + path, 1
+    elif entry.sub_plan and not isinstance(entry.field, ListField):
+        for sub_entry in entry.sub_plan:
+            for update in iter_plan_updates(sub_entry, getattr(value, sub_entry.name),
+                                            path + '__'):
+                yield update
+    else:
+        yield 'set__' + path, value
+
+def reference_pk(value):
+    """
+    Returns the primary key of a stored reference (a document, a `DBRef` or
+    the raw id) without dereferencing it.
+    """
+    if isinstance(value, DBRef):
+        return value.id
+    elif isinstance(value, BaseDocument):
+        return value.pk
+    return value
+
+def mongo_value(field, value):
+    """
+    Returns the value as stored by the given mongoengine field, references
+    are reduced to their primary key without being dereferenced.
+    """
+    if value is None:
+        return None
+    elif isinstance(field, ReferenceField):
+        return reference_pk(value)
+    elif isinstance(field, ListField) and isinstance(field.field, ReferenceField):
+        return [reference_pk(ref) for ref in value]
+    return field.to_mongo(value)
+
+def array_updates(path, stored, values, origins):
+    """
+    Returns the raw updates turning the `stored` array into `values`, given
+    the stored index each value comes from (see `fields.RowList`): a $set of
+    the changed items and of the removed ones to null, a $pull of the nulls
+    and a $push of the appended items, as `(array length before, update)`
+    to apply in order. Returns None when the whole array should be set
+    instead, when the items were reordered, rows inserted before the end or
+    nothing is kept.
+    """
+    kept = [origin for origin in origins if origin is not None]
+    if not kept or origins[:len(kept)] != kept or \
+            sorted(set(kept)) != kept or kept[-1] >= len(stored):
+        return None
+
+    kept_set = set(kept)
+    removed = [index for index in xrange(len(stored)) if index not in kept_set]
+    if removed and None in stored:
+        # the removed items are pulled as nulls
+        return None
+
+    items = {}
+    for position, origin in enumerate(kept):
+        if values[position] != stored[origin]:
+            items['%s.%d' % (path, origin)] = values[position]
+    for index in removed:
+        items['%s.%d' % (path, index)] = None
+
+    updates = items and [(len(stored), {'$set': items})] or []
+    if removed:
+        updates.append((len(stored), {'$pull': {path: None}}))
+    if len(values) > len(kept):
+        updates.append((len(kept), {'$push': {path: {'$each': values[len(kept):]}}}))
+    return updates
+
+def raw_to_dict(value):
+    """
+    Decodes the embedded documents of a value read from a mapping such as
+    `RawBSONDocument` to dicts, which compare equal to the `to_mongo()` ones.
+    """
+    if isinstance(value, Mapping) and not isinstance(value, dict):
+        return dict([(key, raw_to_dict(item)) for key, item in value.items()])
+    elif isinstance(value, list):
+        return [raw_to_dict(item) for item in value]
+    return value
+
+def raw_to_python(field, value):
+    """
+    Converts a raw stored value to the initial value of a form field.
+    Embedded documents are left as the dicts the embedded forms expect,
+    rather than being built and converted back with `mongo_to_dict`.
+    """
+    if value is None:
+        return None
+    elif isinstance(field, EmbeddedDocumentField) or \
+            isinstance(field, ListField) and isinstance(field.field, EmbeddedDocumentField):
+        return value
+    return field.to_python(value)
+
 def to_dict(val):
     if isinstance(val, list):
         return [to_dict(item) for item in val]
@@ -0,0 +1,188 @@
+"""
+Render-free validation of nested JSON data with a MongoForm class, for API
+endpoints which never render the form::
+
+    cleaned_data, errors = PersonForm.get_validator().validate(json.loads(body))
+
+The data of a `FormsetField` is a list of rows, each a dict of the row
+form's fields or, for lists of strings and references, the value itself. A
+`DictField` is a dict and a `FormField` (embedded document) a dict of its
+fields. The cleaned data and errors are those of the form bound to the
+equivalent flattened data, without building the form, its BoundFields,
+formsets and prefixed names: the fields of the class are cleaned directly.
+Rows may have the formset's 'DELETE' and 'ORDER' keys, and every row is
+validated as an initial row of the formset.
+
+Forms with `clean()` or `clean_<field>()` hooks are not supported, their
+hooks need a form instance.
+"""
+import weakref
+
+from django import forms
+from django.forms.forms import NON_FIELD_ERRORS
+from django.forms.formsets import DELETION_FIELD_NAME, ORDERING_FIELD_NAME
+from django.utils.translation import ugettext_lazy
+
+from fields import FormsetField, FormsetValue, FormField, FormValue, plain_value
+from instrumentation import timed
+
+__all__ = ('FormValidator', 'get_validator')
+
+NOT_AN_OBJECT = ugettext_lazy(u'Enter an object of the form fields.')
+
+# validators compiled per form class, see `get_validator`
+_validators = weakref.WeakKeyDictionary()
+
+
+def get_validator(form_class):
+    """Returns the `FormValidator` of a form class, compiled once.."""
+    try:
+        return _validators[form_class]
+    except KeyError:
+        validator = _validators[form_class] = FormValidator(form_class)
+        return validator
+
+
+class FieldStep(object):
+    """reads a field's value from the data, as its widget reads the form data.."""
+
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+        widget = field.widget
+        if type(widget).value_from_datadict.im_func is forms.Widget.value_from_datadict.im_func:
+            self.read = self.read_value
+        else:
+            self.read = self.read_widget
+
+    def read_value(self, data):
+        return data.get(self.name)
+
+    def read_widget(self, data):
+        return self.field.widget.value_from_datadict(data, None, self.name)
+
+
+class DisabledFieldStep(FieldStep):
+    def __init__(self, name, field):
+        super(DisabledFieldStep, self).__init__(name, field)
+        self.read = self.read_initial
+
+    def read_initial(self, data):
+        initial = self.field.initial
+        return initial() if callable(initial) else initial
+
+
+class FormsetStep(FieldStep):
+    """validates the rows of a `FormsetField` as `FormsetInput` does.."""
+
+    def __init__(self, name, field):
+        super(FormsetStep, self).__init__(name, field)
+        self.form_cls = field.form_cls
+        self.rows = get_validator(field.form_cls)
+        self.max_rows = field.widget.formset.absolute_max
+        self.scalar_name = 'da_string' if 'da_string' in self.form_cls.base_fields else None
+        self.order_field = forms.IntegerField(required=False)
+        self.delete_field = forms.BooleanField(required=False)
+        self.read = self.read_rows
+
+    def read_rows(self, data):
+        rows = data.get(self.name)
+        if isinstance(rows, dict):
+            rows = self.form_cls.format_initial(rows)
+        values = []
+        ordering = []
+        numbers = []
+        row_errors = []
+
+        for index, row in enumerate((rows or [])[:self.max_rows], 1):
+            if not isinstance(row, dict) and self.scalar_name:
+                row = {self.scalar_name: row}
+            if self.delete_field.clean(self.delete_field.widget.value_from_datadict(
+                    row, None, DELETION_FIELD_NAME)):
+                continue
+
+            cleaned_data, errors = self.rows.validate(row)
+            try:
+                order = self.order_field.clean(row.get(ORDERING_FIELD_NAME))
+            except forms.ValidationError, e:
+                errors[ORDERING_FIELD_NAME] = e.messages
+            if errors:
+                row_errors.append((index, errors))
+                continue
+
+            ordering.append(999 if order is None else order)
+            numbers.append(index)
+            values.append(self.form_cls.to_python(cleaned_data))
+
+        # stable sort on the order keys, as the formset does
+        rows = sorted(zip(ordering, values, numbers), key=lambda item: item[0])
+        return FormsetValue(self.form_cls.format_values([value for _, value, _ in rows],
+                                                        [number for _, _, number in rows]),
+                            row_errors)
+
+
+class FormStep(FieldStep):
+    """builds the embedded document of a `FormField` as `FormInput` does.."""
+
+    def __init__(self, name, field):
+        super(FormStep, self).__init__(name, field)
+        self.form_cls = field.widget.form_cls
+        self.subform = get_validator(self.form_cls)
+        self.read = self.read_form
+
+    def read_form(self, data):
+        subdata = data.get(self.name) or {}
+        if not isinstance(subdata, dict):
+            raise forms.ValidationError(NOT_AN_OBJECT)
+        cleaned_data = {}
+        for step in self.subform.steps:
+            value = plain_value(step.read(subdata))
+            if value:
+                cleaned_data[step.name] = step.field.to_python(value)
+        return FormValue(self.form_cls.format_values(self.form_cls.to_python(cleaned_data)))
+
+
+class FormValidator(object):
+    """
+    The fields of a form class compiled to steps reading nested data, see
+    the module documentation. Validators are shared by the threads, the
+    fields of the class are not copied.
+    """
+
+    def __init__(self, form_class):
+        if getattr(form_class.clean, 'im_func', None) is not forms.BaseForm.clean.im_func:
+            raise ValueError('%s has a clean() method, validate it with a form instance'
+                             % form_class.__name__)
+        self.form_class = form_class
+        self.steps = []
+        for name, field in form_class.base_fields.items():
+            if hasattr(form_class, 'clean_%s' % name):
+                raise ValueError('%s has a clean_%s() method, validate it with a form instance'
+                                 % (form_class.__name__, name))
+            if getattr(field, 'disabled', False):
+                step_class = DisabledFieldStep
+            elif isinstance(field, FormsetField):
+                step_class = FormsetStep
+            elif isinstance(field, FormField):
+                step_class = FormStep
+            else:
+                step_class = FieldStep
+            self.steps.append(step_class(name, field))
+
+    def validate(self, data):
+        """
+        Returns the `(cleaned_data, errors)` of the data, the errors a dict
+        of the messages of each invalid field, empty for valid data. Data
+        other than a dict is a non field error.
+        """
+        cleaned_data = {}
+        errors = {}
+        if not isinstance(data, dict):
+            return cleaned_data, {NON_FIELD_ERRORS: [unicode(NOT_AN_OBJECT)]}
+        with timed(self.form_class.__name__, 'full_clean'):
+            for step in self.steps:
+                try:
+                    cleaned_data[step.name] = step.field.clean(step.read(data))
+                except forms.ValidationError, e:
+                    errors[step.name] = e.messages
+        return cleaned_data, errors
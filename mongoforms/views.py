@@ -0,0 +1,57 @@
+import json
+
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.encoding import smart_unicode
+from django.views.generic import View
+from bson.errors import InvalidId
+from mongoengine.errors import ValidationError
+
+
+class ReferenceSearchView(View):
+    """
+    JSON endpoint paginating the choices of a `ReferenceSearchWidget`::
+
+        url(r'^authors/search/$', ReferenceSearchView.as_view(
+            queryset=Author.objects, search_field='name'))
+
+    The `q` GET parameter filters on a prefix of `search_field`, which should
+    be indexed. Pages are ordered by primary key and `after` takes the `next`
+    cursor of the previous page, so no page is fetched with skip. An invalid
+    cursor is a bad request.
+    """
+    queryset = None
+    search_field = None
+    page_size = 20
+
+    def get_queryset(self):
+        return self.queryset.clone()
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        document = queryset._document
+        id_field = document._meta.get('id_field', 'id')
+
+        term = request.GET.get('q')
+        if term and self.search_field:
+            queryset = queryset.filter(**{'%s__startswith' % self.search_field: term})
+
+        after = request.GET.get('after')
+        if after:
+            field = document._fields[id_field]
+            try:
+                after = field.to_python(after)
+                field.validate(after)
+            except (InvalidId, ValidationError, TypeError, ValueError):
+                return HttpResponseBadRequest('invalid cursor')
+            queryset = queryset.filter(**{'%s__gt' % id_field: after})
+
+        docs = list(queryset.order_by(id_field).limit(self.page_size + 1))
+        more = len(docs) > self.page_size
+        docs = docs[:self.page_size]
+
+        data = {
+            'results': [{'id': unicode(doc.pk), 'text': smart_unicode(doc)} for doc in docs],
+            'more': more,
+            'next': unicode(docs[-1].pk) if more else None,
+        }
+        return HttpResponse(json.dumps(data), content_type='application/json')
@@ -40,6 +40,7 @@ setup(
     url='http://github.com/stephrdev/django-mongoforms/',
     packages=find_packages(
         exclude=['examples', 'examples.*', 'testprj', 'testprj.*']),
+    package_data={'mongoforms': ['static/mongoforms/*.js']},
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Web Environment',
@@ -51,5 +52,5 @@ setup(
     ],
     zip_safe=False,
     cmdclass={"test": TestRunner},
-    requires=['Django', 'mongoengine(>=0.6)', 'pymongo(>=2.1)']
+    requires=['Django', 'mongoengine(>=0.6)', 'pymongo(>=3.0)']
 )
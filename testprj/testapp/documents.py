@@ -24,3 +24,62 @@ class Test002StringField(Document):
         ('XL', 'Extra Large'),
         ('XXL', 'Extra Extra Large')))
     string_field_2 = StringField(choices=('S', 'M', 'L', 'XL', 'XXL'))
+
+
+class Test004ParentList(Document):
+    parents = ListField(ReferenceField(Test001Parent))
+
+
+class Test005Item(EmbeddedDocument):
+    name = StringField(required=True)
+
+
+class Test005ItemList(Document):
+    items = ListField(EmbeddedDocumentField(Test005Item))
+
+
+class Test006Address(EmbeddedDocument):
+    street = StringField()
+    city = StringField()
+
+
+class Test006Person(Document):
+    name = StringField(required=True)
+    address = EmbeddedDocumentField(Test006Address)
+
+
+class Test007Pair(Document):
+    first = ReferenceField(Test001Parent, required=True)
+    second = ReferenceField(Test001Parent, required=True)
+
+
+class Test008Tagged(EmbeddedDocument):
+    name = StringField()
+    tags = ListField(StringField())
+
+
+class Test008Post(Document):
+    title = StringField(required=True)
+    tagged = EmbeddedDocumentField(Test008Tagged)
+
+
+class Test009Country(EmbeddedDocument):
+    name = StringField()
+
+
+class Test009City(EmbeddedDocument):
+    name = StringField()
+    country = EmbeddedDocumentField(Test009Country)
+
+
+class Test009Place(Document):
+    name = StringField(required=True)
+    city = EmbeddedDocumentField(Test009City)
+
+
+class Test010Revised(Document):
+    items = ListField(EmbeddedDocumentField(Test005Item))
+    revision = IntField(default=0)
+
+    def clean(self):
+        self.revision += 1
@@ -2,8 +2,11 @@ from django.forms import CharField, PasswordInput
 from mongoengine.django.auth import User
 
 from mongoforms import MongoForm
+from mongoforms.fields import ReferenceField
 
-from documents import Test001Child, Test002StringField
+from documents import (Test001Parent, Test001Child, Test002StringField, Test004ParentList,
+    Test005ItemList, Test006Person, Test007Pair, Test008Post,
+    Test009Place, Test010Revised)
 
 
 class Test001ChildForm(MongoForm):
@@ -12,6 +15,13 @@ class Test001ChildForm(MongoForm):
         fields = ('parent', 'name')
 
 
+class Test001ChildSearchForm(MongoForm):
+    class Meta:
+        document = Test001Child
+        fields = ('parent', 'name')
+    parent = ReferenceField(Test001Parent.objects, search_url='/parents/')
+
+
 class Test002StringFieldForm(MongoForm):
     class Meta:
         document = Test002StringField
@@ -24,3 +34,45 @@ class Test003FormFieldOrder(MongoForm):
         fields = ('username', 'email', 'password')
     password = CharField(widget=PasswordInput, label="Your password")
     repeat_password = CharField(widget=PasswordInput, label="Repeat password")
+
+
+class Test004ParentListForm(MongoForm):
+    class Meta:
+        document = Test004ParentList
+        fields = ('parents',)
+
+
+class Test005ItemListForm(MongoForm):
+    class Meta:
+        document = Test005ItemList
+        fields = ('items',)
+
+
+class Test006PersonCityForm(MongoForm):
+    class Meta:
+        document = Test006Person
+        fields = ('name', 'address__city')
+
+
+class Test007PairForm(MongoForm):
+    class Meta:
+        document = Test007Pair
+        fields = ('first', 'second')
+
+
+class Test008PostForm(MongoForm):
+    class Meta:
+        document = Test008Post
+        fields = ('title', 'tagged')
+
+
+class Test009PlaceForm(MongoForm):
+    class Meta:
+        document = Test009Place
+        fields = ('name', 'city')
+
+
+class Test010RevisedForm(MongoForm):
+    class Meta:
+        document = Test010Revised
+        fields = ('items',)
@@ -1,2 +1,5 @@
 from fields import *
+from cache import ChoiceCacheTests
+from formsets import MongoFormSetTests
+from importer import ImporterTests
 from regression import MongoformsRegressionTests
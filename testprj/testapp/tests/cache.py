@@ -0,0 +1,68 @@
+from django.test.utils import override_settings
+
+from mongoforms import cache
+from mongoforms.cache import ChoiceCache
+from mongoforms.fields import ReferenceField
+
+from ..documents import Test001Parent
+
+from testprj.tests import MongoengineTestCase
+
+
+class ChoiceCacheTests(MongoengineTestCase):
+
+    def setUp(self):
+        MongoengineTestCase.setUp(self)
+        Test001Parent.objects.delete()
+        self.parent = Test001Parent(name='parent1')
+        self.parent.save()
+        self.cache = ChoiceCache(ttl=60, max_entries=2)
+
+    def test001_choices_are_shared(self):
+        choices = self.cache.get_choices(Test001Parent.objects)
+        self.assertEqual([(self.parent.pk, u'parent1')], choices)
+
+        # bulk updates send no signal, the cached choices are returned
+        Test001Parent.objects.update(set__name='renamed')
+        self.assertIs(choices, self.cache.get_choices(Test001Parent.objects))
+
+    def test002_invalidated_on_save(self):
+        self.cache.get_choices(Test001Parent.objects)
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+        self.assertEqual([], list(self.cache._entries))
+        self.assertTrue((parent2.pk, u'parent2') in
+                        self.cache.get_choices(Test001Parent.objects))
+
+    def test003_least_recently_used_evicted(self):
+        self.cache.get_choices(Test001Parent.objects)
+        self.cache.get_choices(Test001Parent.objects(name='parent1'))
+        self.cache.get_choices(Test001Parent.objects)
+        self.cache.get_choices(Test001Parent.objects(name='other'))
+        self.assertEqual(
+            [self.cache.get_key(Test001Parent.objects),
+             self.cache.get_key(Test001Parent.objects(name='other'))],
+            list(self.cache._entries))
+
+    def test004_invalidated_on_delete(self):
+        self.cache.get_choices(Test001Parent.objects)
+        self.parent.delete()
+        self.assertEqual([], list(self.cache._entries))
+        self.assertEqual([], self.cache.get_choices(Test001Parent.objects))
+
+    def test005_querysets_of_the_fields_not_shared(self):
+        Test001Parent(name='parent2').save()
+        cache._choice_cache = None
+        try:
+            with override_settings(MONGOFORMS_CHOICE_CACHE_TTL=60):
+                first = ReferenceField(Test001Parent.objects.order_by('name').limit(1))
+                every = ReferenceField(Test001Parent.objects.order_by('name'))
+                only = ReferenceField(Test001Parent.objects.order_by('name').only('id'))
+                self.assertEqual([u'----', u'parent1'],
+                                 [label for _, label in first.choices])
+                self.assertEqual([u'----', u'parent1', u'parent2'],
+                                 [label for _, label in every.choices])
+                self.assertEqual(3, len(only.choices))
+                self.assertEqual(3, len(cache.get_choice_cache()._entries))
+        finally:
+            cache._choice_cache = None
@@ -0,0 +1,112 @@
+from django.test.utils import override_settings
+
+from mongoforms import cache
+from mongoforms.formsets import mongoformset_factory
+
+from ..documents import (Test001Parent, Test005Item, Test005ItemList, Test006Address,
+    Test006Person)
+
+from testprj.tests import MongoengineTestCase
+
+
+ParentFormSet = mongoformset_factory(Test001Parent, fields=('name',), extra=1)
+PersonCityFormSet = mongoformset_factory(Test006Person, fields=('name', 'address__city'),
+                                         extra=0)
+ItemListFormSet = mongoformset_factory(Test005ItemList, fields=('items',), extra=1)
+
+
+class MongoFormSetTests(MongoengineTestCase):
+
+    def setUp(self):
+        MongoengineTestCase.setUp(self)
+        Test001Parent.objects.delete()
+        self.parent1 = Test001Parent(name='parent1')
+        self.parent1.save()
+        self.parent2 = Test001Parent(name='parent2')
+        self.parent2.save()
+
+    def test001_rows_from_queryset(self):
+        formset = ParentFormSet(queryset=Test001Parent.objects.order_by('name'))
+        self.assertEqual(3, formset.total_form_count())
+        self.assertEqual(self.parent1, formset.forms[0].instance)
+        self.assertEqual(unicode(self.parent2.pk), formset.forms[1]['pk'].value())
+
+    def test002_bulk_save(self):
+        formset = ParentFormSet({
+            'form-TOTAL_FORMS': '3', 'form-INITIAL_FORMS': '2',
+            # rows are matched back by pk, whatever their order
+            'form-0-pk': unicode(self.parent2.pk), 'form-0-name': 'renamed',
+            'form-1-pk': unicode(self.parent1.pk), 'form-1-name': 'parent1',
+            'form-2-name': 'parent3',
+        })
+        self.assertTrue(formset.is_valid())
+        saved = formset.save()
+
+        self.assertEqual([u'parent3', u'renamed'], [p.name for p in saved])
+        self.assertEqual([u'parent3'], [p.name for p in formset.new_objects])
+        self.assertTrue(formset.new_objects[0].pk)
+        self.assertEqual([u'parent1', u'parent3', u'renamed'],
+            sorted(Test001Parent.objects.scalar('name')))
+
+    def test003_unknown_pk_is_a_row_error(self):
+        formset = ParentFormSet({
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+            'form-0-pk': 'ffffffffffffffffffffffff', 'form-0-name': 'other',
+        })
+        self.assertFalse(formset.is_valid())
+        self.assertTrue('pk' in formset.errors[0])
+
+    def test004_invalid_pk_is_a_row_error(self):
+        formset = ParentFormSet({
+            'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '2',
+            'form-0-pk': 'not an id', 'form-0-name': 'other',
+            'form-1-pk': unicode(self.parent1.pk), 'form-1-name': 'parent1',
+        })
+        self.assertFalse(formset.is_valid())
+        self.assertTrue('pk' in formset.errors[0])
+        self.assertEqual({}, formset.errors[1])
+
+    def test005_partial_embedded_document(self):
+        Test006Person.objects.delete()
+        person = Test006Person(name='name',
+                               address=Test006Address(street='street', city='city'))
+        person.save()
+        formset = PersonCityFormSet({
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+            'form-0-pk': unicode(person.pk), 'form-0-name': 'name',
+            # embedded subforms aren't prefixed with the row
+            'address-city': 'town',
+        })
+        self.assertTrue(formset.is_valid())
+        formset.save()
+
+        person.reload()
+        self.assertEqual('street', person.address.street)
+        self.assertEqual('town', person.address.city)
+
+    def test006_blank_extra_row_with_a_list(self):
+        Test005ItemList.objects.delete()
+        formset = ItemListFormSet({
+            'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '0',
+            'form-0-items-TOTAL_FORMS': '0', 'form-0-items-INITIAL_FORMS': '0',
+        })
+        self.assertTrue(formset.is_valid())
+        self.assertEqual([], formset.save())
+        self.assertEqual(0, Test005ItemList.objects.count())
+
+    def test007_choice_cache_invalidated(self):
+        cache._choice_cache = None
+        try:
+            with override_settings(MONGOFORMS_CHOICE_CACHE_TTL=60):
+                choice_cache = cache.get_choice_cache()
+                choice_cache.get_choices(Test001Parent.objects)
+                formset = ParentFormSet({
+                    'form-TOTAL_FORMS': '1', 'form-INITIAL_FORMS': '1',
+                    'form-0-pk': unicode(self.parent1.pk), 'form-0-name': 'renamed',
+                })
+                self.assertTrue(formset.is_valid())
+                formset.save()
+                self.assertTrue((self.parent1.pk, u'renamed') in
+                                choice_cache.get_choices(Test001Parent.objects))
+        finally:
+            cache._choice_cache = None
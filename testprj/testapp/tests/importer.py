@@ -0,0 +1,46 @@
+import json
+from StringIO import StringIO
+
+from mongoforms.forms import mongoform_factory
+from mongoforms.importer import read_records, import_records
+
+from ..documents import Test001Parent
+
+from testprj.tests import MongoengineTestCase
+
+
+class ImporterTests(MongoengineTestCase):
+
+    def setUp(self):
+        MongoengineTestCase.setUp(self)
+        Test001Parent.objects.delete()
+
+    def test001_csv_records(self):
+        records = read_records(StringIO('name\nparent1\n\nparent2\n'))
+        self.assertEqual([{u'name': u'parent1'}, {u'name': u'parent2'}], list(records))
+
+    def test002_valid_records_inserted_rejects_reported(self):
+        records = [{'name': 'parent%d' % i} for i in range(5)]
+        records.insert(2, {'name': ''})
+        errors = StringIO()
+
+        result = import_records(mongoform_factory(Test001Parent), iter(records),
+                                chunk_size=2, errors=errors)
+
+        self.assertEqual((6, 5, 1), (result.read, result.inserted, result.rejected))
+        self.assertEqual(5, Test001Parent.objects.count())
+        reject = json.loads(errors.getvalue())
+        self.assertEqual(3, reject['record'])
+        self.assertTrue('name' in reject['errors'])
+
+    def test003_csv_line_with_extra_columns_rejected(self):
+        errors = StringIO()
+        records = read_records(StringIO('name\nparent1\nparent2,extra\nparent3\n'))
+
+        result = import_records(mongoform_factory(Test001Parent), records, errors=errors)
+
+        self.assertEqual((3, 2, 1), (result.read, result.inserted, result.rejected))
+        self.assertEqual([u'parent1', u'parent3'], sorted(Test001Parent.objects.scalar('name')))
+        reject = json.loads(errors.getvalue())
+        self.assertEqual(2, reject['record'])
+        self.assertEqual([u'extra'], reject['data']['__extra__'])
@@ -1,7 +1,27 @@
-from django.test.client import Client
+import gc
+import json
 
-from ..documents import Test001Parent
-from ..forms import Test002StringFieldForm, Test003FormFieldOrder
+from django.test.client import Client, RequestFactory
+
+from bson import BSON
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from django.forms import CharField
+from mongoengine import ValidationError, signals
+
+from ..documents import (Test001Parent, Test001Child, Test005Item, Test005ItemList,
+    Test006Address, Test006Person, Test007Pair, Test008Post,
+    Test009Place, Test010Revised)
+from ..forms import (Test001ChildForm, Test001ChildSearchForm, Test002StringFieldForm,
+    Test003FormFieldOrder, Test004ParentListForm, Test005ItemListForm,
+    Test006PersonCityForm, Test007PairForm, Test008PostForm,
+    Test009PlaceForm, Test010RevisedForm)
+
+from mongoforms import MongoForm, instrumentation
+from mongoforms.forms import (MongoFormMetaClass, warm_up, mongoform_factory,
+    clear_mongoform_factory_cache, _mongoform_factory_cache)
+from mongoforms.prefork import preload, unfreeze_gc
+from mongoforms.views import ReferenceSearchView
 
 from testprj.tests import MongoengineTestCase
 
@@ -47,3 +67,570 @@ class MongoformsRegressionTests(MongoengineTestCase):
         self.assertListEqual(
             ['username', 'email', 'password', 'repeat_password'],
             form.fields.keys())
+
+    def test004_ReferenceField_choices_are_lazy(self):
+        # the form class is defined before the parent exists
+        Test001Parent.objects.delete()
+        parent = Test001Parent(name='lazy parent')
+        parent.save()
+
+        form = Test001ChildForm()
+        self.assertIn(unicode(parent.pk), form.as_p())
+
+        # a posted form doesn't need the choices to validate
+        form = Test001ChildForm({'parent': parent.pk, 'name': 'child'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(parent, form.cleaned_data['parent'])
+
+    def test005_ListField_ReferenceField_resolved_in_order(self):
+        Test001Parent.objects.delete()
+        parent1 = Test001Parent(name='parent1')
+        parent1.save()
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+        missing = ObjectId()
+
+        data = {
+            'parents-TOTAL_FORMS': '2',
+            'parents-INITIAL_FORMS': '0',
+            'parents-0-da_string': unicode(parent2.pk),
+            'parents-1-da_string': unicode(parent1.pk),
+        }
+        form = Test004ParentListForm(data)
+        self.assertTrue(form.is_valid())
+        self.assertEqual([parent2, parent1], form.cleaned_data['parents'])
+
+        # unknown ids are reported for their own row
+        data['parents-1-da_string'] = unicode(missing)
+        form = Test004ParentListForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(1, len(form.errors['parents']))
+        self.assertTrue(form.errors['parents'][0].startswith('da_string 2 :'))
+
+        # numbered by the posted row, whatever was deleted or reordered before
+        data.update({'parents-TOTAL_FORMS': '3', 'parents-0-DELETE': 'on',
+                     'parents-1-da_string': unicode(parent1.pk),
+                     'parents-2-da_string': unicode(missing)})
+        form = Test004ParentListForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(1, len(form.errors['parents']))
+        self.assertTrue(form.errors['parents'][0].startswith('da_string 3 :'))
+
+    def test006_ReferenceSearchView_pages_by_id(self):
+        Test001Parent.objects.delete()
+        parents = []
+        for name in ('anna', 'anne', 'annie', 'bob'):
+            parent = Test001Parent(name=name)
+            parent.save()
+            parents.append(parent)
+
+        view = ReferenceSearchView.as_view(queryset=Test001Parent.objects,
+            search_field='name', page_size=2)
+
+        page = json.loads(view(RequestFactory().get('/', {'q': 'ann'})).content)
+        self.assertEqual([u'anna', u'anne'], [r['text'] for r in page['results']])
+        self.assertTrue(page['more'])
+
+        page = json.loads(view(RequestFactory().get('/',
+            {'q': 'ann', 'after': page['next']})).content)
+        self.assertEqual([u'annie'], [r['text'] for r in page['results']])
+        self.assertFalse(page['more'])
+        self.assertEqual(None, page['next'])
+
+    def test007_FormsetInput_keeps_no_state(self):
+        Test001Parent.objects.delete()
+        parent = Test001Parent(name='parent1')
+        parent.save()
+
+        data = {
+            'parents-TOTAL_FORMS': '1',
+            'parents-INITIAL_FORMS': '0',
+            'parents-0-da_string': unicode(parent.pk),
+        }
+        bound = Test004ParentListForm(data)
+        self.assertTrue(bound.is_valid())
+
+        # a readonly render doesn't remove the delete checkbox of other forms
+        unbound = Test004ParentListForm(initial={'parents': [parent]})
+        unbound['parents'].as_widget(attrs={'readonly': 'readonly'})
+        self.assertTrue('parents-0-DELETE' in unicode(unbound['parents']))
+
+        # the bound form renders its own data
+        self.assertTrue(unicode(parent.pk) in unicode(bound['parents']))
+        self.assertEqual(None, getattr(bound.fields['parents'].widget, 'form', None))
+
+    def test008_FormsetInput_streams_rows(self):
+        Test001Parent.objects.delete()
+        parents = []
+        for name in ('parent1', 'parent2', 'parent3'):
+            parent = Test001Parent(name=name)
+            parent.save()
+            parents.append(parent)
+
+        form = Test004ParentListForm(initial={'parents': parents})
+        chunks = list(form.iter_render_field('parents'))
+        # management form, list opening, one chunk per row, list closing, ...
+        self.assertTrue(len(chunks) > len(parents) + 3)
+        self.assertEqual(unicode(form['parents']), u''.join(chunks))
+
+    def test009_ais_valid_and_asave(self):
+        Test001Parent.objects.delete()
+        parent = Test001Parent(name='parent1')
+        parent.save()
+
+        form = Test001ChildForm({'parent': unicode(parent.pk), 'name': 'child'})
+        self.assertTrue(form.ais_valid().get())
+        self.assertEqual(parent, form.cleaned_data['parent'])
+        child = form.asave().get()
+        self.assertEqual(u'child', Test001Child.objects.get(pk=child.pk).name)
+
+        form = Test001ChildForm({'parent': unicode(ObjectId()), 'name': 'child'})
+        self.assertFalse(form.ais_valid().get())
+        self.assertTrue('parent' in form.errors)
+
+    def test010_instrumentation_records_phases(self):
+        Test001Parent.objects.delete()
+        parent = Test001Parent(name='parent1')
+        parent.save()
+
+        collector = instrumentation.ListCollector()
+        instrumentation.add_collector(collector)
+        collector.start()
+        try:
+            form = Test001ChildForm({'parent': unicode(parent.pk), 'name': 'child'})
+            form.is_valid()
+        finally:
+            instrumentation.remove_collector(collector)
+        records = collector.stop()
+
+        phases = [(r.phase, r.field) for r in records]
+        for phase in [('init', None), ('lookup', None), ('clean', 'parent'),
+                      ('validate', 'name'), ('full_clean', None)]:
+            self.assertTrue(phase in phases)
+        self.assertTrue(all(r.form is form for r in records))
+
+    def test011_fields_generated_on_first_use(self):
+        form_class = MongoFormMetaClass('LazyParentForm', (MongoForm,),
+            {'Meta': type('Meta', (object,), {'document': Test001Parent})})
+        self.assertFalse(form_class.is_built())
+        self.assertEqual(['name'], form_class().fields.keys())
+        self.assertTrue(form_class.is_built())
+
+        form_class = MongoFormMetaClass('LazyParentForm', (MongoForm,),
+            {'Meta': type('Meta', (object,), {'document': Test001Parent})})
+        self.assertTrue(form_class in [c for c, _ in warm_up()])
+        self.assertTrue(form_class.is_built())
+
+    def test012_preload_builds_forms(self):
+        gc_threshold = gc.get_threshold()
+        form_class = MongoFormMetaClass('PreloadParentForm', (MongoForm,),
+            {'Meta': type('Meta', (object,), {'document': Test001Parent})})
+        report = preload()
+        self.assertTrue(form_class.is_built())
+        self.assertTrue(report.classes >= 1)
+        self.assertEqual(gc_threshold, gc.get_threshold())
+
+        # the workers restore the collection after the fork
+        preload(freeze=True)
+        unfreeze_gc()
+        self.assertEqual(gc_threshold, gc.get_threshold())
+
+    def test013_bind_raw_document(self):
+        Test001Parent.objects.delete()
+        Test001Child.objects.delete()
+        parent = Test001Parent(name='parent1')
+        parent.save()
+        child = Test001Child(parent=parent, name='child1')
+        child.save()
+
+        raw = Test001ChildForm.load_raw(pk=child.pk)
+        self.assertTrue(isinstance(raw, dict))
+        self.assertEqual(Test001ChildForm(instance=child).as_p(),
+                         Test001ChildForm(raw=raw).as_p())
+
+        form = Test001ChildForm({'parent': unicode(parent.pk), 'name': 'child2'}, raw=raw)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual(['name'], form.changed_fields)
+        self.assertEqual('child2', Test001Child.objects.get(pk=child.pk).name)
+
+    def test014_validator_matches_form(self):
+        Test001Parent.objects.delete()
+        parent1 = Test001Parent(name='parent1')
+        parent1.save()
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+
+        validator = Test004ParentListForm.get_validator()
+        for parents in ([parent2.pk, parent1.pk], [parent1.pk, ObjectId()]):
+            data = {'parents-TOTAL_FORMS': '2', 'parents-INITIAL_FORMS': '2'}
+            for index, pk in enumerate(parents):
+                data['parents-%d-da_string' % index] = unicode(pk)
+            form = Test004ParentListForm(data)
+            form.is_valid()
+
+            cleaned_data, errors = validator.validate(
+                {'parents': [unicode(pk) for pk in parents]})
+            self.assertEqual(form.cleaned_data, cleaned_data)
+            self.assertEqual(dict((name, list(messages)) for name, messages
+                                  in form.errors.items()), errors)
+
+        # embedded document rows, reordered, deleted or invalid
+        validator = Test005ItemListForm.get_validator()
+        for rows in ([{'name': 'a', 'ORDER': 2}, {'name': 'b', 'ORDER': 1},
+                      {'name': 'c', 'DELETE': True}],
+                     [{'name': 'a'}, {'name': 'b', 'DELETE': True}, {'name': ''}]):
+            # the validator's rows are initial rows, never skipped when empty
+            data = {'items-TOTAL_FORMS': str(len(rows)), 'items-INITIAL_FORMS': str(len(rows))}
+            for index, row in enumerate(rows):
+                data['items-%d-name' % index] = row['name']
+                if 'ORDER' in row:
+                    data['items-%d-ORDER' % index] = str(row['ORDER'])
+                if row.get('DELETE'):
+                    data['items-%d-DELETE' % index] = 'on'
+            form = Test005ItemListForm(data)
+            form.is_valid()
+
+            cleaned_data, errors = validator.validate({'items': rows})
+            self.assertEqual(form.cleaned_data, cleaned_data)
+            self.assertEqual(dict((name, list(messages)) for name, messages
+                                  in form.errors.items()), errors)
+
+        # an embedded document
+        form = Test006PersonCityForm({'name': 'name', 'address-city': 'town'})
+        form.is_valid()
+        cleaned_data, errors = Test006PersonCityForm.get_validator().validate(
+            {'name': 'name', 'address': {'city': 'town'}})
+        self.assertEqual(form.cleaned_data, cleaned_data)
+        self.assertEqual({}, errors)
+
+        self.assertEqual(({}, {'__all__': [u'Enter an object of the form fields.']}),
+                         validator.validate([]))
+        self.assertEqual(['address'], Test006PersonCityForm.get_validator().validate(
+            {'name': 'name', 'address': 'town'})[1].keys())
+
+    def test015_list_items_updated_in_place(self):
+        Test005ItemList.objects.delete()
+        doc = Test005ItemList(items=[Test005Item(name=name) for name in ('a', 'b', 'c')])
+        doc.save()
+
+        data = {'items-TOTAL_FORMS': '4', 'items-INITIAL_FORMS': '3',
+                'items-0-name': 'a', 'items-0-ORDER': '1',
+                'items-1-name': 'B', 'items-1-ORDER': '2',
+                'items-2-name': 'c', 'items-2-ORDER': '3', 'items-2-DELETE': 'on',
+                'items-3-name': 'd'}
+        form = Test005ItemListForm(data, instance=doc)
+        self.assertTrue(form.is_valid())
+
+        # only the edited items are written, a change of another one is kept
+        Test005ItemList.objects(pk=doc.pk).update_one(set__items__0__name='A')
+        saved = []
+        def post_save(sender, document, **kwargs):
+            saved.append((document, kwargs['created']))
+        signals.post_save.connect(post_save, sender=Test005ItemList)
+        try:
+            form.save()
+        finally:
+            signals.post_save.disconnect(post_save, sender=Test005ItemList)
+        self.assertEqual([(doc, False)], saved)
+        self.assertEqual(['A', 'B', 'd'],
+                         [item.name for item in Test005ItemList.objects.get(pk=doc.pk).items])
+
+        # the complete instance is validated before the items are written
+        doc.reload()
+        form = Test005ItemListForm(data, instance=doc)
+        self.assertTrue(form.is_valid())
+        form.cleaned_data['items'][0].name = None
+        self.assertRaises(ValidationError, form.save)
+        self.assertEqual(['A', 'B', 'd'],
+                         [item.name for item in Test005ItemList.objects.get(pk=doc.pk).items])
+
+        # the list's length changed meanwhile, the whole list is set
+        doc.reload()
+        form = Test005ItemListForm(data, instance=doc)
+        self.assertTrue(form.is_valid())
+        Test005ItemList.objects(pk=doc.pk).update_one(push__items=Test005Item(name='e'))
+        form.save()
+        self.assertEqual(['a', 'B', 'd'],
+                         [item.name for item in Test005ItemList.objects.get(pk=doc.pk).items])
+
+    def test016_load_instance_saves_loaded_subfields(self):
+        Test006Person.objects.delete()
+        person = Test006Person(name='name',
+                               address=Test006Address(street='street', city='city'))
+        person.save()
+
+        self.assertEqual(['name', 'address.city'], Test006PersonCityForm.get_projection())
+        instance = Test006PersonCityForm.load_instance(pk=person.pk)
+        self.assertEqual(None, instance.address.street)
+
+        saved = []
+        def post_save(sender, document, **kwargs):
+            saved.append(document)
+        signals.post_save.connect(post_save, sender=Test006Person)
+        try:
+            form = Test006PersonCityForm({'name': 'name', 'address-city': 'town'},
+                                         instance=instance)
+            self.assertTrue(form.is_valid())
+            form.save()
+        finally:
+            signals.post_save.disconnect(post_save, sender=Test006Person)
+
+        self.assertEqual([instance], saved)
+        person.reload()
+        self.assertEqual('street', person.address.street)
+        self.assertEqual('town', person.address.city)
+
+    def test017_mongoform_factory_cache(self):
+        clear_mongoform_factory_cache()
+        form_class = mongoform_factory(Test001Parent, extra_meta={'fields': ('name',)})
+        self.assertTrue(form_class is
+                        mongoform_factory(Test001Parent, extra_meta={'fields': ('name',)}))
+        self.assertFalse(form_class is
+                         mongoform_factory(Test001Parent, extra_meta={'exclude': ('name',)}))
+        self.assertEqual(2, len(_mongoform_factory_cache))
+
+        # overridden fields built per call can't be told apart, they aren't cached
+        first = mongoform_factory(Test001Parent, extra_attrs={'name': CharField()})
+        second = mongoform_factory(Test001Parent, extra_attrs={'name': CharField()})
+        self.assertFalse(first is second)
+        self.assertEqual(2, len(_mongoform_factory_cache))
+
+        clear_mongoform_factory_cache()
+        self.assertFalse(form_class is
+                         mongoform_factory(Test001Parent, extra_meta={'fields': ('name',)}))
+
+    def test018_ReferenceSearchView_cursors(self):
+        Test001Parent.objects.delete()
+        for name in ('anna', 'anne', 'annie', 'bob'):
+            Test001Parent(name=name).save()
+        view = ReferenceSearchView.as_view(queryset=Test001Parent.objects, page_size=2)
+
+        page = json.loads(view(RequestFactory().get('/')).content)
+        self.assertTrue(page['more'])
+        page = json.loads(view(RequestFactory().get('/', {'after': page['next']})).content)
+        self.assertEqual([u'annie', u'bob'], [r['text'] for r in page['results']])
+        self.assertFalse(page['more'])
+        self.assertEqual(None, page['next'])
+
+        response = view(RequestFactory().get('/', {'after': 'foo'}))
+        self.assertEqual(400, response.status_code)
+
+        # an invalid bound form renders the selected document, or none
+        anna = Test001Parent.objects.get(name='anna')
+        form = Test001ChildSearchForm({'parent': unicode(anna.pk)})
+        self.assertFalse(form.is_valid())
+        self.assertTrue(u'>anna</option>' in unicode(form['parent']))
+        for pk in ('garbage', unicode(ObjectId())):
+            form = Test001ChildSearchForm({'parent': pk})
+            self.assertFalse(form.is_valid())
+            self.assertFalse(u'anna' in unicode(form['parent']))
+
+    def test019_ais_valid_cleans_references_concurrently(self):
+        Test001Parent.objects.delete()
+        parent1 = Test001Parent(name='parent1')
+        parent1.save()
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+
+        Test007Pair.objects.delete()
+        form = Test007PairForm({'first': unicode(parent1.pk), 'second': unicode(parent2.pk)})
+        self.assertTrue(form.ais_valid().get())
+        self.assertEqual(parent1, form.cleaned_data['first'])
+        self.assertEqual(parent2, form.cleaned_data['second'])
+        pair = Test007Pair.objects.get(pk=form.asave().get().pk)
+        self.assertEqual((parent1, parent2), (pair.first, pair.second))
+
+        form = Test007PairForm({'first': unicode(parent1.pk), 'second': unicode(ObjectId())})
+        self.assertFalse(form.ais_valid().get())
+        self.assertEqual(['second'], form.errors.keys())
+        self.assertEqual(parent1, form.cleaned_data['first'])
+
+        # the fields of the form are restored afterwards
+        for name in ('first', 'second'):
+            self.assertTrue(form.fields[name].clean is Test007PairForm.base_fields[name].clean)
+            self.assertFalse('value_from_datadict' in form.fields[name].widget.__dict__)
+
+    def test020_bind_raw_embedded_list(self):
+        Test005ItemList.objects.delete()
+        doc = Test005ItemList(items=[Test005Item(name=name) for name in ('a', 'b')])
+        doc.save()
+        data = {'items-TOTAL_FORMS': '2', 'items-INITIAL_FORMS': '2',
+                'items-0-name': 'a', 'items-0-ORDER': '1',
+                'items-1-name': 'b', 'items-1-ORDER': '2'}
+
+        raw = Test005ItemListForm.load_raw(pk=doc.pk)
+        raw_bson = RawBSONDocument(BSON.encode(raw))
+        for raw in (raw, raw_bson):
+            self.assertEqual(Test005ItemListForm(instance=doc).as_p(),
+                             Test005ItemListForm(raw=raw).as_p())
+            form = Test005ItemListForm(data, raw=raw)
+            self.assertTrue(form.is_valid())
+            form.save()
+            self.assertEqual([], form.changed_fields)
+
+        data['items-1-name'] = 'B'
+        form = Test005ItemListForm(data, raw=raw_bson)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual(['items'], form.changed_fields)
+        self.assertEqual(['a', 'B'],
+                         [item.name for item in Test005ItemList.objects.get(pk=doc.pk).items])
+        self.assertRaises(AssertionError, Test005ItemListForm, raw=raw_bson, instance=doc)
+
+    def test021_embedded_document_with_list(self):
+        Test008Post.objects.delete()
+        data = {'title': 'title', 'tagged-name': 'name',
+                'tagged-tags-TOTAL_FORMS': '2', 'tagged-tags-INITIAL_FORMS': '0',
+                'tagged-tags-0-da_string': 'a', 'tagged-tags-1-da_string': 'b'}
+        form = Test008PostForm(data)
+        self.assertTrue(form.is_valid())
+        post = form.save()
+        self.assertEqual(['a', 'b'], Test008Post.objects.get(pk=post.pk).tagged.tags)
+
+        cleaned_data, errors = Test008PostForm.get_validator().validate(
+            {'title': 'title', 'tagged': {'name': 'name', 'tags': ['a', 'b']}})
+        self.assertEqual({}, errors)
+        self.assertEqual(['a', 'b'], cleaned_data['tagged'].tags)
+
+        # the lists of an unchanged bound form didn't change
+        doc = Test005ItemList(items=[Test005Item(name='a')])
+        form = Test005ItemListForm({'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1',
+                                    'items-0-name': 'a', 'items-0-ORDER': '1'}, instance=doc)
+        self.assertTrue(form.is_valid())
+        self.assertEqual([], form.changed_data)
+
+    def test022_two_levels_of_embedding(self):
+        Test009Place.objects.delete()
+        data = {'name': 'place', 'city-name': 'Paris', 'country-name': 'France'}
+        form = Test009PlaceForm(data)
+        self.assertTrue(form.is_valid())
+        place = form.save()
+        self.assertEqual('France', Test009Place.objects.get(pk=place.pk).city.country.name)
+
+        form = Test009PlaceForm(data, instance=place)
+        self.assertTrue(form.is_valid())
+        self.assertEqual([], form.changed_data)
+
+        cleaned_data, errors = Test009PlaceForm.get_validator().validate(
+            {'name': 'place', 'city': {'name': 'Paris', 'country': {'name': 'France'}}})
+        self.assertEqual({}, errors)
+        self.assertEqual('France', cleaned_data['city'].country.name)
+
+    def test023_update_writes_the_changes_of_clean_and_pre_save(self):
+        Test010Revised.objects.delete()
+        doc = Test010Revised(items=[Test005Item(name='a'), Test005Item(name='b')])
+        doc.save()
+        self.assertEqual(1, doc.revision)
+
+        form = Test010RevisedForm({'items-TOTAL_FORMS': '2', 'items-INITIAL_FORMS': '2',
+                                   'items-0-name': 'a', 'items-0-ORDER': '1',
+                                   'items-1-name': 'B', 'items-1-ORDER': '2'}, instance=doc)
+        self.assertTrue(form.is_valid())
+        form.save()
+        stored = Test010Revised.objects.get(pk=doc.pk)
+        self.assertEqual(2, stored.revision)
+        self.assertEqual(['a', 'B'], [item.name for item in stored.items])
+
+        # a partially loaded instance isn't cleaned, the signal handlers run
+        Test006Person.objects.delete()
+        person = Test006Person(name='name', address=Test006Address(city='city'))
+        person.save()
+        def pre_save(sender, document, **kwargs):
+            document.name = 'renamed'
+        signals.pre_save.connect(pre_save, sender=Test006Person)
+        try:
+            form = Test006PersonCityForm({'name': 'name', 'address-city': 'town'},
+                                         instance=Test006PersonCityForm.load_instance(
+                                             pk=person.pk))
+            self.assertTrue(form.is_valid())
+            form.save()
+        finally:
+            signals.pre_save.disconnect(pre_save, sender=Test006Person)
+        person.reload()
+        self.assertEqual('renamed', person.name)
+        self.assertEqual('town', person.address.city)
+
+    def test024_binding_an_instance_runs_no_query(self):
+        Test001Parent.objects.delete()
+        Test001Child.objects.delete()
+        Test007Pair.objects.delete()
+        parent1 = Test001Parent(name='parent1')
+        parent1.save()
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+        Test001Child(parent=parent1, name='child').save()
+        Test007Pair(first=parent1, second=parent2).save()
+        child = Test001Child.objects.get()
+        pair = Test007Pair.objects.get()
+
+        # count the queries of the referenced collection
+        collection = Test001Parent._get_collection()
+        queries = []
+        def find(*args, **kwargs):
+            queries.append(args)
+            return type(collection).find(collection, *args, **kwargs)
+        collection.find = find
+        try:
+            child_form = Test001ChildForm(instance=child)
+            pair_form = Test007PairForm(instance=pair)
+            Test007PairForm({'first': unicode(parent2.pk), 'second': unicode(parent1.pk)},
+                            instance=pair)
+            self.assertEqual(unicode(parent1.pk), unicode(child_form['parent'].value()))
+            self.assertEqual(unicode(parent2.pk), unicode(pair_form['second'].value()))
+            self.assertEqual([], queries)
+
+            # the choices of each reference field are queried on render
+            self.assertIn(u'selected>parent1<', child_form.as_p())
+            self.assertEqual(1, len(queries))
+            pair_form.as_p()
+            self.assertEqual(3, len(queries))
+        finally:
+            del collection.find
+
+    def test025_save_sets_only_the_changed_fields(self):
+        Test001Parent.objects.delete()
+        Test001Child.objects.delete()
+        parent1 = Test001Parent(name='parent1')
+        parent1.save()
+        parent2 = Test001Parent(name='parent2')
+        parent2.save()
+        child = Test001Child(parent=parent1, name='child')
+        child.save()
+
+        form = Test001ChildForm({'parent': unicode(parent1.pk), 'name': 'renamed'},
+                                instance=Test001Child.objects.get(pk=child.pk))
+        self.assertTrue(form.is_valid())
+        # the unchanged parent is changed meanwhile
+        Test001Child.objects(pk=child.pk).update_one(set__parent=parent2)
+
+        # record the updates sent by Document.save(), through any collection object
+        collection_class = type(Test001Child._get_collection())
+        update_one = collection_class.update_one
+        updates = []
+        def record(collection, filter, update, *args, **kwargs):
+            updates.append(update)
+            return update_one(collection, filter, update, *args, **kwargs)
+        collection_class.update_one = record
+        try:
+            form.save()
+        finally:
+            collection_class.update_one = update_one
+
+        self.assertEqual(['name'], form.changed_fields)
+        self.assertEqual([{'$set': {'name': u'renamed'}}], updates)
+        stored = Test001Child.objects.get(pk=child.pk)
+        self.assertEqual('renamed', stored.name)
+        self.assertEqual(parent2, stored.parent)
+
+    def test026_formset_controls_and_media(self):
+        form = Test005ItemListForm(initial={'items': [Test005Item(name='a')]})
+        html = unicode(form['items'])
+        # the row and the empty row have their controls
+        self.assertEqual(2, html.count('data-formset-remove'))
+        self.assertEqual(2, html.count('data-formset-move="up"'))
+        readonly = form['items'].as_widget(attrs={'readonly': 'readonly'})
+        self.assertFalse('data-formset-remove' in readonly)
+
+        # a formset nested only in an embedded document loads the script
+        self.assertTrue('mongoforms/formset.js' in unicode(Test008PostForm().media))